@@ -0,0 +1,292 @@
+# -*- coding: utf-8 -*-
+'''
+Benchmarks of stepping, rendering and memory use.
+
+    python benchmark.py --out results.json
+    python benchmark.py --sizes 25 256 --backends numpy frontier --compare old.json
+
+Step cases time each step backend in cell updates per second (cells of the
+grid times steps, over the time taken) for every grid size, initRule and
+spreadRule. "legacy" is the per-cell changeState loop of model.py and
+"tiled" a tiles.TiledSimulation; the per-cell Python loops ("legacy", and
+"compiled" without numba) are only timed on the small sizes.
+
+Render cases time the drawing paths in frames per second: model.drawState
+over every cell ("drawState"), interface.GridRenderer ("cells") and
+interface.ImageGridRenderer ("image"). They also count the requests the
+Tk thread runs per frame (see profiling.py): round trips (requests a
+caller waits on) and commands (all requests). Every frame ends with one
+flush of the window, so it is timed until Tk has drawn it. Render cases
+need a display and are skipped without one.
+
+Every case runs in a fresh process, so the peak RSS (resident set size)
+recorded with it is that of the case alone. Results are written as JSON;
+--compare prints the change in every rate against an earlier results file.
+'''
+
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import sys
+import time
+import numpy as np
+from profiling import enableProfiling, disableProfiling
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+SIZES = (25, 64, 256, 1024, 4096)
+INIT_RULES = (0, 1, 2, 3, 4)
+SPREAD_RULES = (0, 1)
+BACKENDS = ("legacy", "numpy", "frontier", "compiled", "strips", "tiled")
+RENDERERS = ("drawState", "cells", "image")
+
+# Largest grid side the per-cell Python loops are timed at
+SLOW_MAX_SIZE = 64
+
+# Largest grid side each renderer is timed at
+RENDER_MAX_SIZE = {"drawState": 64, "cells": 256, "image": 4096}
+
+# Largest side of a render window in pixels; cells shrink to fit
+RENDER_MAX_PIXELS = 1024
+
+
+# Peak resident set size of this process in bytes, or None where the
+# resource module is missing
+def peakRss():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+# Whether the per-cell Python loops run compiled
+def _compiled():
+    from kernels import HAVE_NUMBA
+    return HAVE_NUMBA
+
+
+# Step function of 'backend' for an m x n grid
+def _stepper(backend, m, initRule, spreadRule, probSpore, seed):
+    if backend == "legacy":
+        return _legacyStepper(m, initRule, spreadRule, probSpore, seed)
+    if backend == "tiled":
+        from tiles import TiledSimulation
+        sim = TiledSimulation(m, m, initRule, seed=seed, probSpore=probSpore,
+                              spreadRule=spreadRule)
+    else:
+        from engine import Simulation
+        sim = Simulation(m, m, initRule, seed=seed, probSpore=probSpore,
+                         backend=backend, spreadRule=spreadRule)
+    return sim.step
+
+
+# One step of model.changeState over every cell, as the original main loop
+# ran it, on model's globals
+def _legacyStepper(m, initRule, spreadRule, probSpore, seed):
+    import model
+    from streams import makeGenerator
+    model.m = model.n = m
+    model.winDims = (m, m)
+    model.spreadRule = spreadRule
+    model.probSpore = probSpore
+    model.numMushrooms = 0
+    model.rng = makeGenerator(seed)
+    model.grid = model.initGrid(initRule)
+
+    def step():
+        copyGrid = model.grid.copy()
+        for i in range(m):
+            for j in range(m):
+                model.changeState(copyGrid, i, j)
+    return step
+
+
+# Times one step case: 'warmup' untimed steps, then steps until 'minTime'
+# seconds or 'maxSteps' steps have passed (at least one step)
+def stepCase(backend, size, initRule, spreadRule, probSpore=0.05, seed=1,
+             warmup=2, minTime=1.0, maxSteps=100):
+    rssBefore = peakRss()
+    step = _stepper(backend, size, initRule, spreadRule, probSpore, seed)
+    for _ in range(warmup):
+        step()
+    times = []
+    total = 0.0
+    while not times or (total < minTime and len(times) < maxSteps):
+        start = time.perf_counter()
+        step()
+        times.append(time.perf_counter() - start)
+        total += times[-1]
+    return {
+        "backend": backend, "size": size, "initRule": initRule,
+        "spreadRule": spreadRule, "steps": len(times), "seconds": total,
+        "medianStepSeconds": float(np.median(times)),
+        "cellUpdatesPerSecond": size * size * len(times) / total,
+        "rssBefore": rssBefore, "peakRss": peakRss(),
+    }
+
+
+# Reason render cases cannot run here, or None. Run in a process of its
+# own, since a failed Tk start cannot be undone.
+def _displayProblem():
+    try:
+        import tkinter
+        tkinter.Tk().destroy()
+    except Exception as e:
+        return "%s: %s" % (type(e).__name__, e)
+    return None
+
+
+# Times one render case: 'frames' steps of a numpy Simulation, each drawn
+# with 'renderer' and flushed
+def renderCase(renderer, size, initRule=1, seed=1, frames=20):
+    rssBefore = peakRss()
+    import model
+    import interface
+    from engine import Simulation
+    cellWidth = max(1, RENDER_MAX_PIXELS // size)
+    model.winDims = (size, size)
+    model.cellWidth = cellWidth
+    win = model.openWindow()
+    if renderer == "drawState":
+        def draw(grid):
+            for x in range(size):
+                for y in range(size):
+                    model.drawState(grid[x, y], x, y)
+    elif renderer == "cells":
+        draw = interface.GridRenderer(win, cellWidth).draw
+    else:
+        draw = interface.ImageGridRenderer(win, cellWidth).draw
+
+    sim = Simulation(size, size, initRule, seed=seed)
+    # The first frame builds the canvas items; it is timed apart
+    start = time.perf_counter()
+    draw(sim.grid)
+    win.flush()
+    firstFrame = time.perf_counter() - start
+
+    grids = [sim.step().copy() for _ in range(frames)]
+    profiler = enableProfiling()
+    start = time.perf_counter()
+    for grid in grids:
+        draw(grid)
+        win.flush()
+    seconds = time.perf_counter() - start
+    disableProfiling()
+    counters = profiler.stats()["counters"]
+    win.close()
+    return {
+        "renderer": renderer, "size": size, "initRule": initRule,
+        "frames": frames, "seconds": seconds, "firstFrameSeconds": firstFrame,
+        "framesPerSecond": frames / seconds,
+        "roundTripsPerFrame": counters.get("tkRoundTrips", 0) / frames,
+        "commandsPerFrame": counters.get("tkCommands", 0) / frames,
+        "rssBefore": rssBefore, "peakRss": peakRss(),
+    }
+
+
+def _stepCases(sizes, backends, initRules, spreadRules, compiled):
+    for backend in backends:
+        slow = backend == "legacy" or (backend == "compiled" and not compiled)
+        for size in sizes:
+            if slow and size > SLOW_MAX_SIZE:
+                continue
+            for initRule in initRules:
+                for spreadRule in spreadRules:
+                    yield backend, size, initRule, spreadRule
+
+
+# Runs the benchmarks and returns the results
+def runBenchmarks(sizes=SIZES, backends=BACKENDS, initRules=INIT_RULES,
+                  spreadRules=SPREAD_RULES, renderers=RENDERERS, minTime=1.0,
+                  maxSteps=100, frames=20, log=print):
+    from sweep import codeVersion
+    results = {
+        "version": codeVersion(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "compiled": _compiled(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "step": [],
+        "render": [],
+    }
+    # Fresh spawned process for every case
+    context = multiprocessing.get_context("spawn")
+    with context.Pool(1, maxtasksperchild=1) as pool:
+        for case in _stepCases(sizes, backends, initRules, spreadRules, results["compiled"]):
+            result = pool.apply(stepCase, case, {"minTime": minTime, "maxSteps": maxSteps})
+            results["step"].append(result)
+            log("step %-8s %5d  init %d spread %d  %12.0f cells/s" % (
+                case + (result["cellUpdatesPerSecond"],)))
+
+        problem = pool.apply(_displayProblem) if renderers else None
+        if problem is not None:
+            results["renderSkipped"] = problem
+            log("render skipped: %s" % problem)
+            renderers = ()
+        for renderer in renderers:
+            for size in sizes:
+                if size > RENDER_MAX_SIZE[renderer]:
+                    continue
+                result = pool.apply(renderCase, (renderer, size), {"frames": frames})
+                results["render"].append(result)
+                log("render %-9s %5d  %8.2f fps  %6.1f round trips/frame" % (
+                    renderer, size, result["framesPerSecond"], result["roundTripsPerFrame"]))
+    return results
+
+
+# Rate of every case in 'results', by case
+def _rates(results):
+    rates = {}
+    for r in results["step"]:
+        key = "step %s %d init %d spread %d" % (r["backend"], r["size"], r["initRule"], r["spreadRule"])
+        rates[key] = r["cellUpdatesPerSecond"]
+    for r in results["render"]:
+        rates["render %s %d" % (r["renderer"], r["size"])] = r["framesPerSecond"]
+    return rates
+
+
+# Ratio of the new rate to the old one for every case in both results;
+# below 1 is a slowdown
+def compareResults(old, new):
+    oldRates, newRates = _rates(old), _rates(new)
+    return {key: newRates[key] / oldRates[key] for key in newRates if key in oldRates}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the mushroom model.")
+    parser.add_argument("--out", default="benchmark.json", help="results file")
+    parser.add_argument("--sizes", type=int, nargs="+", default=SIZES)
+    parser.add_argument("--backends", nargs="+", default=BACKENDS, choices=BACKENDS)
+    parser.add_argument("--init-rules", type=int, nargs="+", default=INIT_RULES)
+    parser.add_argument("--spread-rules", type=int, nargs="+", default=SPREAD_RULES)
+    parser.add_argument("--renderers", nargs="*", default=RENDERERS, choices=RENDERERS)
+    parser.add_argument("--min-time", type=float, default=1.0,
+                        help="seconds of steps to time per case")
+    parser.add_argument("--max-steps", type=int, default=100)
+    parser.add_argument("--frames", type=int, default=20, help="frames per render case")
+    parser.add_argument("--compare", help="earlier results file to compare against")
+    args = parser.parse_args(argv)
+
+    results = runBenchmarks(args.sizes, args.backends, args.init_rules,
+                            args.spread_rules, args.renderers, args.min_time,
+                            args.max_steps, args.frames)
+    with open(args.out, "w") as f:
+        json.dump(results, f, indent=1)
+
+    if args.compare:
+        with open(args.compare) as f:
+            old = json.load(f)
+        for key, ratio in sorted(compareResults(old, results).items()):
+            print("%-40s %6.2fx%s" % (key, ratio, "  slower" if ratio < 0.9 else ""))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+'''
+Checkpoints of engine.Simulation runs.
+
+A checkpoint is a compressed .npz file holding the grid (two cells per
+byte, see engine.packStates), the full state of the random streams, the
+step counter, probSpore/numMushrooms and every rule parameter. Loading one
+gives a Simulation that continues exactly as the saved run would have.
+
+    checkpointer = Checkpointer("run-{step}.npz", every=100)
+    sim.attach(checkpointer)
+    sim.run(10000)
+    checkpointer.close()
+
+    sim = loadCheckpoint("run-5000.npz")
+
+Checkpointer only copies the grid and the stream state between steps;
+packing, compression and the write itself happen on a background thread.
+'''
+
+import json
+import os
+import queue
+import threading
+import numpy as np
+from engine import Simulation, packStates, unpackStates
+from streams import StackedGenerator
+
+FORMAT_VERSION = 1
+
+
+# JSON-friendly copy of a bit generator state, whose values may hold arrays
+def _encodeState(value):
+    if isinstance(value, dict):
+        return {key: _encodeState(item) for key, item in value.items()}
+    if isinstance(value, np.ndarray):
+        return {"__array__": value.tolist(), "dtype": str(value.dtype)}
+    if isinstance(value, np.integer):
+        return int(value)
+    return value
+
+
+def _decodeState(value):
+    if isinstance(value, dict):
+        if "__array__" in value:
+            return np.array(value["__array__"], dtype=value["dtype"])
+        return {key: _decodeState(item) for key, item in value.items()}
+    return value
+
+
+# Everything needed to rebuild 'generator': its bit generator state and the
+# seed sequence that later spawn() calls draw from
+def _generatorState(generator):
+    bitGenerator = generator.bit_generator
+    seq = bitGenerator.seed_seq
+    return {
+        "state": _encodeState(bitGenerator.state),
+        "entropy": seq.entropy,
+        "spawnKey": list(seq.spawn_key),
+        "poolSize": seq.pool_size,
+        "children": seq.n_children_spawned,
+    }
+
+
+def _restoreGenerator(saved):
+    seq = np.random.SeedSequence(saved["entropy"], spawn_key=saved["spawnKey"],
+                                 pool_size=saved["poolSize"],
+                                 n_children_spawned=saved["children"])
+    state = _decodeState(saved["state"])
+    bitGenerator = getattr(np.random, state["bit_generator"])(seq)
+    bitGenerator.state = state
+    return np.random.Generator(bitGenerator)
+
+
+def _toJson(value):
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+# Metadata and grid of 'sim', copied so the simulation can go on stepping
+def _snapshot(sim):
+    if not isinstance(sim.grid, np.ndarray):
+        raise TypeError("only simulations with an array grid can be checkpointed")
+    if isinstance(sim.rng, StackedGenerator):
+        streams = [_generatorState(g) for g in sim.rng.generators]
+    else:
+        streams = _generatorState(sim.rng)
+    meta = {
+        "version": FORMAT_VERSION,
+        "shape": list(sim.grid.shape),
+        "initRule": sim.initRule,
+        "backend": sim.backend,
+        "params": dict(sim.params),
+        "steps": sim.steps,
+        "probSpore": _toJson(sim.probSpore),
+        "numMushrooms": _toJson(sim.numMushrooms),
+        "stacked": isinstance(sim.rng, StackedGenerator),
+        "streams": streams,
+    }
+    return meta, np.array(sim.grid, dtype=np.uint8)
+
+
+# Writes a snapshot to 'path', going through a temporary file so a crash
+# never leaves a half-written checkpoint behind
+def _write(path, meta, grid):
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        np.savez_compressed(f, grid=packStates(grid), meta=np.array(json.dumps(meta)))
+    os.replace(tmp, path)
+
+
+# Saves the current state of 'sim' to 'path' and waits for the write
+def saveCheckpoint(sim, path):
+    _write(path, *_snapshot(sim))
+
+
+# Simulation that resumes the run saved in 'path'
+def loadCheckpoint(path):
+    with np.load(path, allow_pickle=False) as data:
+        meta = json.loads(str(data["meta"]))
+        packed = data["grid"]
+    if meta["version"] != FORMAT_VERSION:
+        raise ValueError("unsupported checkpoint version %r" % (meta["version"],))
+    shape = tuple(meta["shape"])
+    replicates = shape[0] if len(shape) == 3 else None
+    sim = Simulation(shape[-2], shape[-1], meta["initRule"], replicates=replicates,
+                     backend=meta["backend"], **meta["params"])
+    sim.grid = unpackStates(packed, shape).copy()
+    if meta["stacked"]:
+        sim.rng = StackedGenerator(_restoreGenerator(s) for s in meta["streams"])
+    else:
+        sim.rng = _restoreGenerator(meta["streams"])
+    sim.steps = meta["steps"]
+    sim.probSpore = np.asarray(meta["probSpore"]) if replicates else meta["probSpore"]
+    sim.numMushrooms = np.asarray(meta["numMushrooms"]) if replicates else meta["numMushrooms"]
+    return sim
+
+
+class Checkpointer:
+
+    """Viewer that checkpoints a Simulation every 'every' steps.
+
+    path may contain "{step}", which is replaced by the step number to keep
+    every checkpoint; otherwise each one replaces the last. Writes happen on
+    a background thread, at most 'backlog' of them pending before a step
+    waits for the writer. Call close() to wait for the pending writes;
+    write errors are raised from the next checkpoint or from close().
+    """
+
+    def __init__(self, path, every=100, backlog=2):
+        self.path = path
+        self.every = every
+        self.queue = queue.Queue(maxsize=backlog)
+        self.error = None
+        self.thread = threading.Thread(target=self._writer, daemon=True)
+        self.thread.start()
+
+    def __call__(self, sim):
+        if sim.steps > 0 and sim.steps % self.every == 0:
+            self.save(sim)
+
+    def save(self, sim):
+        """Queue a checkpoint of the current state of sim"""
+        self._raise()
+        meta, grid = _snapshot(sim)
+        self.queue.put((self.path.format(step=sim.steps), meta, grid))
+
+    def close(self):
+        """Wait for the pending checkpoints and stop the writer"""
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+        self._raise()
+
+    def _raise(self):
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    def _writer(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            try:
+                _write(*item)
+            except Exception as e:
+                self.error = e
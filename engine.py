@@ -0,0 +1,656 @@
+# -*- coding: utf-8 -*-
+'''
+Vectorized step engine for the mushroom model in model.py.
+
+stepGrid advances every cell of the grid in one pass. Neighbor counts come
+from shifted array slices, every cell gets a single uniform draw from one
+batched call, and the state diagram on p. 717 is applied through lookup
+tables indexed by the current state. The transition probabilities are the
+same as those of changeState in model.py, so both produce statistically
+identical runs.
+
+All of the grid operations work on the last two axes, so a (K, m, n) stack
+of K independent replicates is stepped by the same code in one call, with
+probSpore and numMushrooms holding one value per replicate.
+
+Grid edges follow the boundary rule parameter: "absorbing" (nothing lies
+outside the grid), "reflecting" (the edge rows and columns are mirrored
+outwards), "periodic" (the grid wraps around), or "legacy", the edges of
+changeState, where the first row and column see no neighbors at all.
+
+Grids hold one uint8 per cell. Simulation keeps two grid buffers and steps
+from one into the other, so no grid is allocated while it runs.
+'''
+
+import functools
+import math
+import numpy as np
+import profiling
+from streams import makeGenerator, stackGenerator
+
+# Cell States Constant
+EMPTY = 0
+SPORE = 1
+YOUNG = 2
+MATURING = 3
+MUSHROOMS = 4
+OLDER = 5
+DECAYING = 6
+DEAD1 = 7
+DEAD2 = 8
+INERT = 9
+NUM_STATES = 10
+
+# State reached when the cell's transition fires, and when it does not.
+# SPORE -> YOUNG with probSporeToHyphae, MATURING -> MUSHROOMS with
+# probMushroom and EMPTY -> YOUNG with the spread probability. Every other
+# state advances (or stays, for INERT) unconditionally.
+_ON_SUCCESS = np.array([YOUNG, YOUNG, MATURING, MUSHROOMS, DECAYING,
+                        DECAYING, DEAD1, DEAD2, EMPTY, INERT], dtype=np.uint8)
+_ON_FAILURE = np.array([EMPTY, SPORE, MATURING, OLDER, DECAYING,
+                        DECAYING, DEAD1, DEAD2, EMPTY, INERT], dtype=np.uint8)
+# Both tables in one, then SPORE for every state, indexed by
+# state + NUM_STATES * outcome (0 failed, 1 fired, 2 spawned a spore)
+_NEXT_STATE = np.concatenate([_ON_FAILURE, _ON_SUCCESS,
+                              np.full(NUM_STATES, SPORE, dtype=np.uint8)])
+
+# States that may be overwritten by a newly spawned spore (1), or not (0),
+# as a factor of the spawn probability.
+_CAN_SPAWN = np.ones(NUM_STATES, dtype=np.float32)
+_CAN_SPAWN[SPORE] = 0
+_CAN_SPAWN[INERT] = 0
+
+# Moore neighborhood used by isNeighborYoung, and the window used by
+# changeState to count neighboring mushrooms (rows i-1:i+1, cols j-1:j+1).
+_MOORE = [(di, dj) for di in (-1, 0, 1) for dj in (-1, 0, 1)]
+_SPORE_WINDOW = [(-1, -1), (-1, 0), (0, -1), (0, 0)]
+
+# Boundary modes, and the np.pad mode that puts the cells just outside the
+# grid in place for each
+BOUNDARIES = ("legacy", "absorbing", "reflecting", "periodic")
+_PAD_MODES = {"absorbing": "constant", "reflecting": "symmetric", "periodic": "wrap"}
+
+
+# Counts, for every cell, how many cells of 'mask' fall in the window
+# given by 'offsets'. Works on the last two axes so stacks of grids are
+# counted in one call. Cells outside the grid are found by padding the mask
+# once according to 'boundary'. Under "legacy", cells outside the grid
+# count as zero and the first row and column see nothing at all, which is
+# what the slices in model.py produce (copyGrid[-1:2] is empty).
+def neighborCount(mask, offsets, boundary="legacy"):
+    m, n = mask.shape[-2:]
+    count = np.zeros(mask.shape, dtype=np.uint8)
+    if boundary != "legacy":
+        pad = [(0, 0)] * (mask.ndim - 2) + [(1, 1), (1, 1)]
+        padded = np.pad(mask, pad, mode=_PAD_MODES[boundary])
+        for di, dj in offsets:
+            count += padded[..., 1 + di:1 + di + m, 1 + dj:1 + dj + n]
+        return count
+    for di, dj in offsets:
+        count[..., max(0, -di):m - max(0, di), max(0, -dj):n - max(0, dj)] += \
+            mask[..., max(0, di):m + min(0, di), max(0, dj):n + min(0, dj)]
+    count[..., 0, :] = 0
+    count[..., :, 0] = 0
+    return count
+
+
+# Maps the positions (r, c), which may lie just outside an m x n grid, onto
+# the grid cells they stand for under 'boundary'. Returns (r, c, inside),
+# where inside is False for positions that stand for nothing.
+def _mapCells(r, c, m, n, boundary):
+    if boundary == "periodic":
+        return r % m, c % n, np.ones(np.shape(r), dtype=bool)
+    if boundary == "reflecting":
+        return np.clip(r, 0, m - 1), np.clip(c, 0, n - 1), np.ones(np.shape(r), dtype=bool)
+    return r, c, (r >= 0) & (r < m) & (c >= 0) & (c < n)
+
+
+# Grid positions of the window 'offsets' around the single cell (i, j),
+# matching neighborCount
+def neighborCells(i, j, shape, offsets, boundary="legacy"):
+    if boundary == "legacy" and (i == 0 or j == 0):
+        return []
+    cells = []
+    for di, dj in offsets:
+        a, b, inside = _mapCells(i + di, j + dj, shape[0], shape[1], boundary)
+        if inside:
+            cells.append((int(a), int(b)))
+    return cells
+
+
+# Probability that randomSpread(dist, numSteps) in model.py succeeds.
+# Each axis of the walk ends at 2k - numSteps with k ~ Binomial(numSteps,
+# 1/2), so the probability is a sum over the joint endpoint distribution.
+# Cached per (dist, numSteps), so it is only worked out once per setting.
+@functools.lru_cache(maxsize=None)
+def walkSpreadProb(dist, numSteps):
+    if dist <= 0:
+        return 1.0
+    pmf = np.array([math.comb(numSteps, k) / (1 << numSteps)
+                    for k in range(numSteps + 1)])
+    end = 2 * np.arange(numSteps + 1) - numSteps
+    far = end[:, None] ** 2 + end[None, :] ** 2 >= dist * dist
+    return float(pmf @ far @ pmf)
+
+
+# Spore spawn probability of every cell under mushroomSporeSpawnRule 1.
+# changeState keeps probSpore in a global that MUSHROOMS cells do not
+# update, so a MUSHROOMS cell reuses the value of the last non-MUSHROOMS
+# cell visited before it in row-major order ('carry' for the first ones).
+# Returns the per-cell probabilities and the value left over for the next
+# step.
+def _localSporeProb(grid, carry, boundary="legacy"):
+    mush = grid == MUSHROOMS
+    prob = neighborCount(mush, _SPORE_WINDOW, boundary) / np.float32(8)
+    return _carrySporeProb(prob, mush, carry)
+
+
+# Gives each MUSHROOMS cell of 'mush' the probability in 'prob' of the last
+# non-MUSHROOMS cell before it in row-major order, or 'carry'. Returns the
+# filled probabilities and the value left over after the last cell.
+def _carrySporeProb(prob, mush, carry):
+    if not mush.any():
+        return prob, prob[..., -1, -1]
+    shape = prob.shape
+    size = shape[-2] * shape[-1]
+    flat = prob.reshape(-1, size).copy()
+    carry = np.broadcast_to(np.asarray(carry, dtype=flat.dtype), shape[:-2]).reshape(-1)
+    # Only the MUSHROOMS cells change. Every run of them within a grid takes
+    # the value of the cell just before its first cell.
+    cells = np.flatnonzero(mush)
+    first = np.ones(cells.size, dtype=bool)
+    first[1:] = cells[1:] != cells[:-1] + 1
+    first |= cells % size == 0
+    starts = cells[first]
+    value = np.where(starts % size == 0, carry[starts // size],
+                     flat.reshape(-1)[starts - 1])
+    flat.reshape(-1)[cells] = value[np.cumsum(first) - 1]
+    return flat.reshape(shape), flat[:, -1].reshape(shape[:-2])
+
+
+# New states of the cells in 'state' (integer array), given their spore
+# spawn probability and their number of YOUNG neighbors ('young', only used
+# with spreadRule 0). Works elementwise, so it serves whole grids, stacks
+# and gathered cells alike. Written into the uint8 array 'out' when given,
+# which must not be 'state' itself.
+def transitionStates(state, spawnProb, young, rng,
+                     probSporeToHyphae=0.6, probMushroom=0.6, probSpread=0.6,
+                     spreadRule=0, randWalkDist=20, numRandWalkSteps=40,
+                     mushroomSpreadRule=0, out=None):
+    spawnProb = np.take(_CAN_SPAWN, state) * spawnProb
+
+    # Per-cell probability that the state's own transition fires, looked up
+    # by state and, under spreadRule 0, number of YOUNG neighbors
+    table = _fireProbTable(probSporeToHyphae, probMushroom, probSpread,
+                           spreadRule, randWalkDist, numRandWalkSteps,
+                           mushroomSpreadRule)
+    if spreadRule == 0:
+        index = np.multiply(young, NUM_STATES, dtype=np.uint8, casting="unsafe")
+        np.add(index, state, out=index, casting="unsafe")
+        prob = np.take(table, index)
+    else:
+        prob = np.take(table, state)
+
+    # One uniform draw per cell decides both the spawn and the transition:
+    # u < spawnProb spawns a spore, otherwise the transition fires with
+    # probability prob.
+    if profiling.active is None:
+        u = rng.random(state.shape, dtype=np.float32)
+    else:
+        with profiling.active.timer("rng"):
+            u = rng.random(state.shape, dtype=np.float32)
+    prob *= 1 - spawnProb
+    prob += spawnProb
+
+    # Spawning implies firing, so the outcome is their sum
+    index = np.add(u < spawnProb, u < prob, dtype=np.uint8)
+    np.multiply(index, NUM_STATES, out=index)
+    np.add(index, state, out=index, casting="unsafe")
+    return np.take(_NEXT_STATE, index, out=out)
+
+
+# Firing probability of transitionStates for every state and number of
+# YOUNG neighbors (0 to 9), flattened to be indexed by
+# state + NUM_STATES * young. Worked out once per setting.
+@functools.lru_cache(maxsize=None)
+def _fireProbTable(probSporeToHyphae, probMushroom, probSpread, spreadRule,
+                   randWalkDist, numRandWalkSteps, mushroomSpreadRule):
+    stateProb = np.ones(NUM_STATES, dtype=np.float32)
+    stateProb[SPORE] = probSporeToHyphae
+    stateProb[MATURING] = probMushroom
+    # EMPTY cells that fail the spread check still get a random walk
+    # attempt, which succeeds with probability walk.
+    walk = np.float32(walkSpreadProb(randWalkDist, numRandWalkSteps))
+    stateProb[EMPTY] = walk
+    table = np.tile(stateProb, (len(_MOORE) + 1, 1))
+    if spreadRule == 0:
+        young = np.arange(len(_MOORE) + 1, dtype=np.uint8)
+        if mushroomSpreadRule == 0:
+            spread = np.where(young > 0, np.float32(probSpread), np.float32(0))
+        else:
+            spread = young / np.float32(8)
+        table[:, EMPTY] = spread + (1 - spread) * walk
+    table = table.reshape(-1)
+    table.flags.writeable = False
+    return table
+
+
+# Change in the number of mushrooms from 'state' to 'new', summed over the
+# last two axes
+def mushroomChange(state, new):
+    grown = np.count_nonzero((state == MATURING) & (new == MUSHROOMS),
+                             axis=(-2, -1))
+    decayed = np.count_nonzero((state == MUSHROOMS) & (new == DECAYING),
+                               axis=(-2, -1))
+    return grown - decayed
+
+
+# Advances 'grid' by one time step and returns (newGrid, probSpore,
+# numMushrooms), where probSpore and numMushrooms are the values changeState
+# would leave in the model.py globals afterwards. For a stack of grids they
+# are arrays with one entry per grid. The new grid is uint8 and is written
+# into 'out' when given (a uint8 array shaped like grid, other than grid).
+def stepGrid(grid, rng, probSpore=0, numMushrooms=0,
+             probSporeToHyphae=0.6, probMushroom=0.6, probSpread=0.6,
+             mushroomSporeSpawnRule=1, spreadRule=0, randWalkDist=20,
+             numRandWalkSteps=40, mushroomSpreadRule=0, boundary="legacy",
+             out=None):
+    state = grid
+
+    # Per-cell spore spawn probability
+    if mushroomSporeSpawnRule == 1:
+        spawnProb, probSpore = _localSporeProb(state, probSpore, boundary)
+    else:
+        spawnProb = np.asarray(probSpore, dtype=np.float32)[..., None, None]
+
+    young = None
+    if spreadRule == 0:
+        young = neighborCount(state == YOUNG, _MOORE, boundary)
+    new = transitionStates(state, spawnProb, young, rng, probSporeToHyphae,
+                           probMushroom, probSpread, spreadRule, randWalkDist,
+                           numRandWalkSteps, mushroomSpreadRule, out)
+
+    if mushroomSporeSpawnRule == 0:
+        numMushrooms = numMushrooms + mushroomChange(state, new)
+
+    return new, probSpore, numMushrooms
+
+
+# Method to initialize a uint8 starting grid of the given shape. A shape of
+# (K, m, n) gives K grids, each initialized independently.
+# RANDOM    = 0
+# SINGLE    = 1
+# DOUBLE    = 2
+# BOUNDARY  = 3
+# CLUMP     = 4
+def initGrid(t, shape, rng, probSpore=0):
+    m, n = shape[-2:]
+
+    # Randomly placed spores, using probSpore
+    if t == 0:
+        return np.where(rng.random(shape) < probSpore, SPORE, EMPTY).astype(np.uint8)
+
+    grid = np.zeros(shape, dtype=np.uint8)
+
+    # Single spore in middle of grid
+    if t == 1:
+        grid[..., m // 2, n // 2] = SPORE
+
+    # Two spores separating two quarters of the grid
+    elif t == 2:
+        grid[..., m // 4, n // 2] = SPORE
+        grid[..., 3 * (m // 4), n // 2] = SPORE
+
+    # Single spore and impermeable barrier around grid. A boundary of
+    # "absorbing" gives closed edges without giving up the outer cells.
+    elif t == 3:
+        grid[..., m // 2, n // 2] = SPORE
+        grid[..., :, 0] = INERT
+        grid[..., :, -1] = INERT
+        grid[..., 0, :] = INERT
+        grid[..., -1, :] = INERT
+
+    # Single spore and a clump of INERT barriers on the other side of grid
+    elif t == 4:
+        grid[..., m // 2, n // 2] = SPORE
+        grid[..., int(3 * m / 5):m, int(n / 5):int(4 * n / 5)] = INERT
+
+    else:
+        raise ValueError("unknown initRule %r" % (t,))
+
+    return grid
+
+
+# Packs a grid of states two cells per byte, for archiving. Returns a flat
+# uint8 array; unpackStates(packed, grid.shape) gives the grid back.
+def packStates(grid):
+    flat = np.asarray(grid, dtype=np.uint8).reshape(-1)
+    if flat.size % 2:
+        flat = np.append(flat, np.uint8(EMPTY))
+    return flat[0::2] | (flat[1::2] << 4)
+
+
+def unpackStates(packed, shape):
+    flat = np.empty(2 * packed.size, dtype=np.uint8)
+    flat[0::2] = packed & 0x0F
+    flat[1::2] = packed >> 4
+    return flat[:math.prod(shape)].reshape(shape)
+
+
+# Rule parameters understood by stepGrid, with the defaults from model.py
+DEFAULT_PARAMS = {
+    'probSporeToHyphae': 0.6,
+    'probMushroom': 0.6,
+    'probSpread': 0.6,
+    'mushroomSporeSpawnRule': 1,
+    'spreadRule': 0,
+    'randWalkDist': 20,
+    'numRandWalkSteps': 40,
+    'mushroomSpreadRule': 0,
+    'boundary': "legacy",
+}
+
+
+# Simulation backends that step a single grid, never a stack of replicates
+SINGLE_GRID_BACKENDS = ("frontier", "strips")
+
+
+# Probability that an EMPTY cell with nothing around it changes: it spawns
+# a spore with probability 'spawn', otherwise its random walk may succeed.
+def idleCellProb(spawn, params):
+    walk = walkSpreadProb(params['randWalkDist'], params['numRandWalkSteps'])
+    return spawn + (1 - spawn) * walk
+
+
+# Counts, for the cells at flat positions rows * n + cols, how many cells
+# of 'flat' (an m x n grid) in the window given by 'offsets' are in
+# 'state'. Same edge handling as neighborCount.
+def _sparseCount(flat, rows, cols, m, n, offsets, state, boundary="legacy"):
+    count = np.zeros(rows.shape, dtype=np.uint8)
+    for di, dj in offsets:
+        r, c, inside = _mapCells(rows + di, cols + dj, m, n, boundary)
+        count += inside & (flat[np.where(inside, r * n + c, 0)] == state)
+    if boundary == "legacy":
+        count[(rows == 0) | (cols == 0)] = 0
+    return count
+
+
+class FrontierStepper:
+
+    """Step function that only evaluates the active part of the grid.
+
+    Keeps the flat indices of the live cells (all but EMPTY and INERT) and
+    evaluates only them and their Moore neighborhoods, with the same rules
+    as stepGrid. Every other cell is EMPTY with nothing around it, so each
+    one becomes a spore or young hyphae with the same small probability:
+    the number that do is drawn from a binomial and only those cells are
+    touched. Cost per step follows the size of the frontier rather than the
+    area of the grid. Once more than denseFraction of the grid is active
+    (or live, which is checked first) it steps the whole grid with stepGrid
+    instead.
+
+    Use through Simulation(backend="frontier"). Takes the stepGrid
+    arguments, works on a single grid and updates it in place (out is
+    ignored); call reset() after changing the grid by hand.
+    """
+
+    # Largest share of the grid a gathered active set may take (9 cells per
+    # live cell); larger ones are found with a neighbor count instead
+    GATHER_FRACTION = 0.02
+
+    def __init__(self, denseFraction=0.08):
+        self.denseFraction = denseFraction
+        self.reset()
+
+    def reset(self):
+        """Forget the live cell index; it is rebuilt on the next step"""
+        self.grid = None
+        self.live = None
+
+    # Indexes the live cells of 'grid'. With more of them than denseFraction
+    # of the grid, every active set would be larger still, so only their
+    # number is kept (live is None) and the next step is dense.
+    def _index(self, grid):
+        flat = grid.reshape(-1)
+        self.grid = grid
+        live = (flat != EMPTY) & (flat != INERT)
+        self.numInert = np.count_nonzero(flat == INERT)
+        if np.count_nonzero(live) > self.denseFraction * flat.size:
+            self.live = None
+        else:
+            self.live = np.flatnonzero(live)
+
+    # Sorted flat indices of the live cells and their Moore neighborhoods
+    def _active(self, m, n, boundary):
+        if len(_MOORE) * self.live.size <= self.GATHER_FRACTION * m * n:
+            rows, cols = np.divmod(self.live, n)
+            cells = []
+            for di, dj in _MOORE:
+                r, c, inside = _mapCells(rows + di, cols + dj, m, n, boundary)
+                cells.append((r * n + c)[inside])
+            return np.unique(np.concatenate(cells))
+        # Dilate the live cells over the whole grid. Under "legacy", cells
+        # outside the grid are simply missing, as for "absorbing"; the
+        # first row and column only see nothing when they are evaluated.
+        live = np.zeros(m * n, dtype=bool)
+        live[self.live] = True
+        if boundary == "legacy":
+            boundary = "absorbing"
+        return np.flatnonzero(neighborCount(live.reshape(m, n), _MOORE, boundary))
+
+    def __call__(self, grid, rng, probSpore=0, numMushrooms=0, out=None, **params):
+        if grid.ndim != 2:
+            raise ValueError("frontier stepping works on a single grid")
+        params = dict(DEFAULT_PARAMS, **params)
+        if grid is not self.grid or not grid.flags.c_contiguous:
+            grid = np.ascontiguousarray(grid)
+            self._index(grid)
+        m, n = grid.shape
+        boundary = params['boundary']
+        # The active set holds at least the live cells, so the live count
+        # alone can send the step to stepGrid
+        dense = self.denseFraction * grid.size
+        active = None
+        if self.live is not None and self.live.size <= dense:
+            active = self._active(m, n, boundary)
+        if active is None or active.size > dense:
+            self.evaluated = grid.size
+            grid[...], probSpore, numMushrooms = stepGrid(
+                grid, rng, probSpore, numMushrooms, **params)
+            self._index(grid)
+            return grid, probSpore, numMushrooms
+
+        flat = grid.reshape(-1)
+        state = flat[active]
+        rows, cols = np.divmod(active, n)
+
+        # Per-cell spore spawn probability, as in _localSporeProb. Cells
+        # outside the active set have no mushrooms around them, so a
+        # MUSHROOMS cell right after one carries 0.
+        rule = params['mushroomSporeSpawnRule']
+        if rule == 1:
+            mush = state == MUSHROOMS
+            own = _sparseCount(flat, rows, cols, m, n, _SPORE_WINDOW,
+                               MUSHROOMS, boundary) / np.float32(8)
+            after = np.ones(active.size, dtype=bool)
+            after[1:] = active[1:] != active[:-1] + 1
+            source = ~mush | after
+            value = np.where(~mush, own, np.where(active == 0, probSpore, 0))
+            value = value.astype(np.float32)
+            last = np.maximum.accumulate(
+                np.where(source, np.arange(active.size), -1))
+            spawnProb = value[last]
+            probSpore = spawnProb[-1] if active[-1] == flat.size - 1 else 0
+            idleSpawn = 0.0
+        else:
+            spawnProb = np.float32(probSpore)
+            idleSpawn = float(probSpore)
+
+        young = None
+        if params['spreadRule'] == 0:
+            young = _sparseCount(flat, rows, cols, m, n, _MOORE, YOUNG, boundary)
+        new = transitionStates(state, spawnProb, young, rng, params['probSporeToHyphae'],
+                               params['probMushroom'], params['probSpread'],
+                               params['spreadRule'], params['randWalkDist'],
+                               params['numRandWalkSteps'], params['mushroomSpreadRule'])
+
+        # Idle cells: EMPTY cells outside the active set
+        numIdle = (flat.size - self.numInert - self.live.size
+                   - np.count_nonzero(state == EMPTY))
+        idleProb = idleCellProb(idleSpawn, params)
+        idle = self._pickIdle(flat, active, rng.binomial(numIdle, idleProb), rng)
+        idleNew = np.where(rng.random(idle.size) * idleProb < idleSpawn,
+                           SPORE, YOUNG)
+
+        if rule == 0:
+            numMushrooms = numMushrooms + mushroomChange(state[None], new[None])
+
+        flat[active] = new
+        flat[idle] = idleNew
+        self.live = np.concatenate([active[(new != EMPTY) & (new != INERT)], idle])
+        self.evaluated = active.size + idle.size
+        return grid, probSpore, numMushrooms
+
+    # Picks 'count' distinct EMPTY cells outside 'active' (sorted) uniformly
+    # at random, by drawing positions over the whole grid and rejecting the
+    # others.
+    def _pickIdle(self, flat, active, count, rng):
+        picked = np.zeros(0, dtype=np.intp)
+        while picked.size < count:
+            cells = rng.integers(0, flat.size, size=2 * (count - picked.size) + 16)
+            at = np.minimum(np.searchsorted(active, cells), active.size - 1)
+            cells = cells[(flat[cells] == EMPTY) & (active[at] != cells)]
+            cells = np.concatenate([picked, cells])
+            _, first = np.unique(cells, return_index=True)
+            picked = cells[np.sort(first)]
+        return picked[:count]
+
+
+class Simulation:
+
+    """A headless run of the mushroom model.
+
+    Holds the grid and the probSpore/numMushrooms state that model.py keeps
+    in globals. Nothing is drawn unless a viewer is attached: viewers are
+    callables that receive the simulation after initialization and after
+    every step.
+
+       sim = Simulation(100, 100, initRule=2, seed=1, spreadRule=1)
+       mushrooms = sim.run(50)
+
+    With replicates=K the simulation steps K independent grids at once:
+    grid is a (K, m, n) stack, probSpore and numMushrooms hold one value
+    per replicate and run returns one row of mushroom counts per
+    replicate. Viewers expect a single grid and are not supported then.
+
+    seed is anything streams.makeGenerator takes. With replicates, each
+    replicate draws from its own stream (see streams.stackGenerator) and
+    seed may also be a list of one seed per replicate.
+
+    The grid is uint8. Steps alternate between two buffers, so the array
+    returned by step() is overwritten two steps later; copy it to keep it.
+
+    backend selects the step function: "numpy" for stepGrid, "frontier"
+    for a FrontierStepper, which only evaluates the active part of mostly
+    empty grids, "compiled" for the per-cell kernel of kernels.py, which
+    keeps the exact sequential semantics of changeState and runs as plain
+    Python when numba is not installed, or "strips" for a StripStepper
+    (strips.py), which steps one large grid on several cores. "frontier"
+    and "strips" take no replicates.
+    """
+
+    def __init__(self, m=25, n=25, initRule=1, seed=None, probSpore=0,
+                 replicates=None, backend="numpy", **params):
+        if backend == "numpy":
+            self.stepper = stepGrid
+        elif backend == "frontier":
+            self.stepper = FrontierStepper()
+        elif backend == "compiled":
+            from kernels import stepGridCompiled
+            self.stepper = stepGridCompiled
+        elif backend == "strips":
+            from strips import StripStepper
+            self.stepper = StripStepper()
+        else:
+            raise ValueError("unknown backend %r" % (backend,))
+        if replicates is not None and backend in SINGLE_GRID_BACKENDS:
+            raise ValueError("backend %r steps a single grid and takes no replicates"
+                             % (backend,))
+        self.backend = backend
+        unknown = set(params) - set(DEFAULT_PARAMS)
+        if unknown:
+            raise TypeError("unknown rule parameters: %s" % ", ".join(sorted(unknown)))
+        self.params = dict(DEFAULT_PARAMS, **params)
+        if self.params['boundary'] not in BOUNDARIES:
+            raise ValueError("unknown boundary %r" % (self.params['boundary'],))
+        self.shape = (m, n)
+        self.initRule = initRule
+        if replicates is None:
+            self.rng = makeGenerator(seed)
+            stack = ()
+        else:
+            self.rng = stackGenerator(seed, replicates)
+            stack = (replicates,)
+        self.grid = initGrid(initRule, stack + self.shape, self.rng, probSpore)
+        self.spare = np.empty_like(self.grid)
+        # Spore spawning is configured after the initial grid is made
+        self.probSpore = 0
+        self.numMushrooms = 0
+        self.steps = 0
+        self.viewers = []
+
+    def attach(self, viewer):
+        """Draw the current grid with viewer and after every later step"""
+        self.viewers.append(viewer)
+        viewer(self)
+
+    def detach(self, viewer):
+        self.viewers.remove(viewer)
+
+    def step(self):
+        """Advance the grid by one time step and return it"""
+        if profiling.active is not None:
+            return self._profiledStep(profiling.active)
+        self._advance()
+        for viewer in self.viewers:
+            viewer(self)
+        return self.grid
+
+    # Steps the grid, without calling the viewers
+    def _advance(self):
+        new, self.probSpore, self.numMushrooms = self.stepper(
+            self.grid, self.rng, self.probSpore, self.numMushrooms,
+            out=self.spare, **self.params)
+        if new is not self.grid:
+            self.grid, self.spare = new, self.grid
+
+        # Calculate spore spawn probability. Only used with spore spawn rule 0
+        if self.params['mushroomSporeSpawnRule'] == 0:
+            self.probSpore = self.numMushrooms / (self.shape[0] * self.shape[1])
+
+        self.steps += 1
+
+    # step() while a profiler is enabled: times the step function and each
+    # viewer, and counts the cells evaluated (all of them, unless the
+    # stepper says otherwise) and changed
+    def _profiledStep(self, profiler):
+        before = self.grid.copy() if isinstance(self.grid, np.ndarray) else None
+        with profiler.timer("step"):
+            self._advance()
+        evaluated = getattr(self.stepper, "evaluated", math.prod(self.grid.shape))
+        profiler.count("cellsEvaluated", evaluated)
+        if before is not None:
+            profiler.count("cellsChanged", int(np.count_nonzero(self.grid != before)))
+        for viewer in self.viewers:
+            with profiler.timer("view " + getattr(viewer, "__name__", type(viewer).__name__)):
+                viewer(self)
+        profiler.stepDone()
+        return self.grid
+
+    def run(self, numSteps):
+        """Run numSteps steps and return the number of mushrooms after each"""
+        mushrooms = np.zeros(self.grid.shape[:-2] + (numSteps,))
+        for k in range(numSteps):
+            self.step()
+            mushrooms[..., k] = self.numMushrooms
+        return mushrooms
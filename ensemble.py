@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+'''
+Ensembles of independent mushroom model runs spread over a process pool.
+
+Every replicate gets its own stream, spawned from a single root seed (see
+streams.py), so an ensemble is reproducible and gives the same results for
+any number of workers. Workers only send back the number of mushrooms at each step, never
+the grids themselves.
+
+With a batchSize, replicates are also stepped batchSize at a time as one
+(batchSize, m, n) stack inside each worker (see engine.Simulation), which is
+far cheaper than one process step per replicate on small grids. Each
+replicate of a stack keeps its own stream, so batched ensembles give the
+same results as unbatched ones.
+'''
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import os
+import numpy as np
+from engine import SINGLE_GRID_BACKENDS, Simulation
+from streams import replicateSeeds
+
+
+# Runs the replicates 'indices' with their 'seeds' and returns
+# (indices, mushrooms), where mushrooms has one row per replicate.
+# Module level so the process pool can pickle it.
+def _runReplicates(indices, seeds, numTimeSteps, m, n, initRule, probSpore, params):
+    mushrooms = np.zeros((len(indices), numTimeSteps))
+    for r, seed in enumerate(seeds):
+        sim = Simulation(m, n, initRule, seed=seed, probSpore=probSpore, **params)
+        mushrooms[r] = sim.run(numTimeSteps)
+    return indices, mushrooms
+
+
+# Runs the replicates 'indices' as one batched simulation, or one at a time
+# with a backend that cannot step a stack
+def _runBatch(indices, seeds, numTimeSteps, m, n, initRule, probSpore, params):
+    if params.get("backend") in SINGLE_GRID_BACKENDS:
+        return _runReplicates(indices, seeds, numTimeSteps, m, n, initRule,
+                              probSpore, params)
+    sim = Simulation(m, n, initRule, seed=seeds, probSpore=probSpore,
+                     replicates=len(indices), **params)
+    return indices, sim.run(numTimeSteps)
+
+
+# Splits range(count) into contiguous chunks of 'size'
+def _chunks(count, size):
+    return [list(range(i, min(i + size, count))) for i in range(0, count, size)]
+
+
+# Tasks (function, indices, seeds) that together run replicates 0 to
+# numReplicates - 1 of 'seed', for a pool of 'workers' processes
+def _ensembleTasks(numReplicates, seed, workers, batchSize=None):
+    seeds = replicateSeeds(seed, numReplicates)
+    # A few chunks per worker keeps the pool busy without sending one
+    # task per replicate
+    if batchSize is None:
+        task = _runReplicates
+        chunks = _chunks(numReplicates, max(1, -(-numReplicates // (4 * workers))))
+    else:
+        task = _runBatch
+        chunks = _chunks(numReplicates, batchSize)
+    return [(task, indices, [seeds[i] for i in indices]) for indices in chunks]
+
+
+# Runs 'numReplicates' simulations of 'numTimeSteps' steps and returns the
+# number of mushrooms at each step of each one, shaped like the 'sims'
+# array of model.py. 'seed' fixes the whole ensemble. 'workers' is the
+# number of processes (all CPUs when None, in-process when 1). 'batchSize'
+# steps that many replicates together in each task. 'onResult' is called
+# with (replicateIndex, mushrooms) as results stream back.
+def runEnsemble(numReplicates, numTimeSteps, m=25, n=25, initRule=1,
+                seed=None, workers=None, probSpore=0, batchSize=None,
+                onResult=None, **params):
+    sims = np.zeros((numReplicates, numTimeSteps))
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    def collect(indices, mushrooms):
+        sims[indices] = mushrooms
+        if onResult is not None:
+            for i, row in zip(indices, mushrooms):
+                onResult(i, row)
+
+    tasks = _ensembleTasks(numReplicates, seed, workers, batchSize)
+    args = (numTimeSteps, m, n, initRule, probSpore, params)
+    if workers == 1:
+        for task, indices, taskSeeds in tasks:
+            collect(*task(indices, taskSeeds, *args))
+        return sims
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(task, indices, taskSeeds, *args)
+                   for task, indices, taskSeeds in tasks]
+        for future in as_completed(futures):
+            collect(*future.result())
+    return sims
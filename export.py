@@ -0,0 +1,245 @@
+# -*- coding: utf-8 -*-
+'''
+Headless export of runs to PNG frames or animated GIFs.
+
+Nothing here needs Tk or a display. Frames are written from the state
+array itself: PNG and GIF are both palette images, so the cell states are
+the pixel values and the colors of the state palette (see palette.py) go in
+the image palette. Every palette argument takes anything
+palette.makePalette does and defaults to model.colorScheme.
+
+    exporter = FrameExporter("frames/ring-{step:05d}.png", scale=4)
+    exporter = FrameExporter("ring.gif", scale=4, fps=15)
+    sim.attach(exporter)
+    sim.run(300)
+    exporter.close()
+
+Encoding and writing happen on a background thread, so exporting costs the
+stepping thread one grid copy per frame. A PNG sequence can be turned into
+a video with e.g. ffmpeg -i ring-%05d.png ring.mp4.
+
+GIF frames are stored with fixed-width LZW codes, clearing the code table
+before it grows, so the encoding is a few array operations rather than a
+Python loop over the pixels. Each frame after the first only holds the
+rectangle that changed. The files are larger than with full LZW; use PNG
+frames where size matters.
+'''
+
+import os
+import queue
+import struct
+import threading
+import zlib
+import numpy as np
+from palette import makePalette
+
+_PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+
+# (NUM_STATES, 3) uint8 RGB table of 'palette', anything
+# palette.makePalette takes (model.colorScheme when None)
+def statePalette(palette=None):
+    if palette is None:
+        from model import colorScheme as palette
+    return makePalette(palette).rgb
+
+
+# Image of 'grid' (indexed [x, y], as the renderers draw it) as an array of
+# palette indices indexed [row, column], each cell a scale x scale block
+def _pixels(grid, scale=1):
+    pixels = np.asarray(grid, dtype=np.uint8).T
+    if scale != 1:
+        pixels = np.repeat(np.repeat(pixels, scale, axis=0), scale, axis=1)
+    return np.ascontiguousarray(pixels)
+
+
+# RGB image (rows, columns, 3) of 'grid', looked up in 'palette'
+def rgbFrame(grid, palette=None, scale=1):
+    return statePalette(palette)[_pixels(grid, scale)]
+
+
+def _pngChunk(kind, data):
+    return (struct.pack(">I", len(data)) + kind + data
+            + struct.pack(">I", zlib.crc32(kind + data) & 0xffffffff))
+
+
+# Bytes of a palette PNG of 'grid'
+def encodePng(grid, palette=None, scale=1, level=6):
+    palette = statePalette(palette)
+    pixels = _pixels(grid, scale)
+    height, width = pixels.shape
+    # Every row starts with its filter type, 0 (none)
+    rows = np.zeros((height, width + 1), dtype=np.uint8)
+    rows[:, 1:] = pixels
+    header = struct.pack(">IIBBBBB", width, height, 8, 3, 0, 0, 0)
+    return (_PNG_SIGNATURE + _pngChunk(b"IHDR", header)
+            + _pngChunk(b"PLTE", palette.tobytes())
+            + _pngChunk(b"IDAT", zlib.compress(rows.tobytes(), level))
+            + _pngChunk(b"IEND", b""))
+
+
+def writePng(path, grid, palette=None, scale=1, level=6):
+    with open(path, "wb") as f:
+        f.write(encodePng(grid, palette, scale, level))
+
+
+# LZW data of the palette indices 'pixels' (any shape), with codes of a
+# fixed width: a clear code goes out before the table would grow
+def _lzwData(pixels, minCodeSize):
+    clear = 1 << minCodeSize
+    width = minCodeSize + 1
+    run = clear - 2
+    flat = pixels.reshape(-1).astype(np.uint16)
+    runs = -(-flat.size // run)
+    codes = np.full((runs, run + 1), clear, dtype=np.uint16)
+    codes.reshape(-1)[np.arange(flat.size) + np.arange(flat.size) // run + 1] = flat
+    codes = np.append(codes.reshape(-1)[:runs + flat.size], clear + 1)
+    bits = ((codes[:, None] >> np.arange(width, dtype=np.uint16)) & 1).astype(np.uint8)
+    data = np.packbits(bits.reshape(-1), bitorder="little").tobytes()
+    # Sub-blocks of at most 255 bytes, each after its length
+    blocks = [bytes([len(data[k:k + 255])]) + data[k:k + 255]
+              for k in range(0, len(data), 255)]
+    return bytes([minCodeSize]) + b"".join(blocks) + b"\x00"
+
+
+class GifWriter:
+
+    """Writes frames of state grids to an animated GIF.
+
+    shape is that of the grids; every frame shows for 1 / fps seconds and
+    the animation loops forever. Call close() to finish the file.
+    """
+
+    def __init__(self, path, shape, palette=None, scale=1, fps=10):
+        palette = statePalette(palette)
+        self.minCodeSize = max(2, (len(palette) - 1).bit_length())
+        self.scale = scale
+        self.delay = max(1, int(round(100 / fps)))
+        self.previous = None
+        table = np.zeros((1 << self.minCodeSize, 3), dtype=np.uint8)
+        table[:len(palette)] = palette
+        height, width = _pixels(np.zeros(shape, dtype=np.uint8), scale).shape
+        self.file = open(path, "wb")
+        self.file.write(b"GIF89a" + struct.pack("<HHBBB", width, height,
+                                                0xf0 | (self.minCodeSize - 1), 0, 0))
+        self.file.write(table.tobytes())
+        # Loop forever
+        self.file.write(b"\x21\xff\x0bNETSCAPE2.0\x03\x01\x00\x00\x00")
+
+    def addFrame(self, grid):
+        full = pixels = _pixels(grid, self.scale)
+        top, left = 0, 0
+        if self.previous is not None:
+            changed = pixels != self.previous
+            rows = np.flatnonzero(changed.any(axis=1))
+            cols = np.flatnonzero(changed.any(axis=0))
+            if rows.size:
+                top, left = rows[0], cols[0]
+                pixels = pixels[top:rows[-1] + 1, left:cols[-1] + 1]
+            else:
+                # Nothing changed; redraw a single pixel
+                pixels = pixels[:1, :1]
+        self.previous = full
+        height, width = pixels.shape
+        # Graphic control: keep the previous frame under this one
+        self.file.write(struct.pack("<BBBBHBB", 0x21, 0xf9, 4, 1 << 2, self.delay, 0, 0))
+        self.file.write(struct.pack("<BHHHHB", 0x2c, int(left), int(top), width, height, 0))
+        self.file.write(_lzwData(pixels, self.minCodeSize))
+
+    def close(self):
+        if not self.file.closed:
+            self.file.write(b"\x3b")
+            self.file.close()
+
+
+# Creates the directory 'path' goes in, if missing
+def _makeDirectory(path):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+
+class FrameExporter:
+
+    """Viewer that exports every 'every'-th grid it sees as an image.
+
+    A path ending in ".gif" gives one animated GIF at fps frames per
+    second; any other path is a PNG sequence and should contain "{step}"
+    (with any format, e.g. "{step:05d}"), which is replaced by the step
+    number. At most 'backlog' frames wait for the encoder before a step
+    blocks. Call close() to write the rest; errors are raised from the next
+    frame or from close().
+    """
+
+    def __init__(self, path, palette=None, scale=1, fps=10, every=1,
+                 level=6, backlog=16):
+        self.path = path
+        self.gif = path.lower().endswith(".gif")
+        if not self.gif and "{step" not in path:
+            raise ValueError("a PNG sequence path needs a {step} field")
+        self.palette = statePalette(palette)
+        self.scale = scale
+        self.fps = fps
+        self.every = every
+        self.level = level
+        self.numFrames = 0
+        self.error = None
+        self.queue = queue.Queue(maxsize=backlog)
+        self.thread = threading.Thread(target=self._encoder, daemon=True)
+        self.thread.start()
+
+    def __call__(self, sim):
+        if sim.steps % self.every == 0:
+            self.export(sim.grid, sim.steps)
+
+    def export(self, grid, step=None):
+        """Queue a copy of grid as the next frame"""
+        self._raise()
+        self.queue.put((np.array(grid, dtype=np.uint8), step))
+        self.numFrames += 1
+
+    def close(self):
+        """Write the pending frames and finish the output"""
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+        self._raise()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _raise(self):
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    def _encoder(self):
+        writer = None
+        frame = 0
+        try:
+            while True:
+                item = self.queue.get()
+                if item is None:
+                    break
+                grid, step = item
+                frame += 1
+                if not self.gif:
+                    path = self.path.format(step=frame - 1 if step is None else step)
+                    _makeDirectory(path)
+                    writePng(path, grid, self.palette, self.scale, self.level)
+                    continue
+                if writer is None:
+                    _makeDirectory(self.path)
+                    writer = GifWriter(self.path, grid.shape, self.palette, self.scale, self.fps)
+                writer.addFrame(grid)
+        except Exception as e:
+            self.error = e
+            # Keep taking frames so the stepping thread never blocks
+            while self.queue.get() is not None:
+                pass
+        finally:
+            if writer is not None:
+                writer.close()
@@ -129,6 +129,11 @@ http://mcsp.wartburg.edu/zelle/python for a quick reference"""
 import time, os, sys
 import tkinter as tk
 
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
 
 ##########################################################################
 # Module Exceptions
@@ -152,6 +157,15 @@ from copy import copy
 from queue import Queue
 import _thread
 import atexit
+import itertools
+import threading
+
+# Timers and counters of the project using this module, if any (see
+#   _tk_pump); graphics works on its own without them
+try:
+    import profiling
+except ImportError:
+    profiling = None
 
 
 _tk_request = Queue(0)
@@ -162,6 +176,9 @@ _root = None
 _thread_running = True
 _exception_info = None
 
+# Commands held back by an open batch (see GraphWin.batch), per thread
+_batch_state = threading.local()
+
 def _tk_thread():
     global _root
     _root = tk.Tk()
@@ -171,8 +188,19 @@ def _tk_thread():
 
 def _tk_pump():
     global _thread_running
+    # with a profiler enabled, count every request before it runs (so the
+    #   counts are complete when a waiting caller wakes up) and time the
+    #   whole drain of the queue
+    profiler = profiling.active if profiling is not None else None
+    if profiler is not None:
+        start = time.perf_counter()
+        drained = not _tk_request.empty()
     while not _tk_request.empty():
         command,returns_value = _tk_request.get()
+        if profiler is not None:
+            profiler.count("tkCommands")
+            if returns_value:
+                profiler.count("tkRoundTrips")
         try:
             result = command()
             if returns_value:
@@ -182,6 +210,8 @@ def _tk_pump():
             if returns_value:
                 _tk_result.put(None) # release client
             raise # re-raise the exception -- kills the thread
+    if profiler is not None and drained:
+        profiler.add("tkPump", time.perf_counter() - start)
     if _thread_running:
         _root.after(_POLL_INTERVAL, _tk_pump)
 
@@ -194,6 +224,7 @@ def _tkCall(f, *args, **kw):
         raise GraphicsError(DEAD_THREAD)
     def func():
         return f(*args, **kw)
+    _tkFlushBatch()
     _tk_request.put((func,True),True)
     result = _tk_result.get(True)
     return result
@@ -207,10 +238,41 @@ def _tkExec(f, *args, **kw):
         raise GraphicsError(DEAD_THREAD)
     def func():
         return f(*args, **kw)
-    _tk_request.put((func,False),True)
+    batch = getattr(_batch_state, "commands", None)
+    if batch is not None:
+        batch.append(func)
+    else:
+        _tk_request.put((func,False),True)
     #if _exception_info is not None:
     #    raise GraphicsError, "Invalid Operation: %s" % str(_exception_info)
 
+def _tkExecMany(funcs, wait=False):
+    # schedule a list of argument-less callables to execute, in order,
+    #   as a single request in one pass of the Tk thread. With wait
+    #   set, block until they have all run (one synchronization point
+    #   for the whole list).
+    if not _thread_running:
+        raise GraphicsError(DEAD_THREAD)
+    funcs = list(funcs)
+    def func():
+        for f in funcs:
+            f()
+    if wait:
+        _tkCall(func)
+    else:
+        _tkExec(func)
+
+def _tkFlushBatch():
+    # send the commands held by this thread's open batch, if any, so that
+    #   a synchronous call runs after them
+    batch = getattr(_batch_state, "commands", None)
+    if batch:
+        _batch_state.commands = []
+        def func():
+            for f in batch:
+                f()
+        _tk_request.put((func,False),True)
+
 def _tkShutdown():
     # shutdown the tk thread
     global _thread_running
@@ -224,6 +286,32 @@ _thread.start_new_thread(_tk_thread,())
 # Kill the tk thread at exit
 atexit.register(_tkShutdown)
 
+class _TkBatch:
+    # Context manager behind GraphWin.batch. Batches nest; only the
+    #   outermost one sends the commands.
+
+    def __init__(self, win):
+        self.win = win
+
+    def __enter__(self):
+        self.outer = getattr(_batch_state, "commands", None) is None
+        if self.outer:
+            _batch_state.commands = []
+            self.autoflush = self.win.autoflush
+            self.win.autoflush = False
+        return self.win
+
+    def __exit__(self, *exc):
+        if not self.outer:
+            return False
+        batch = _batch_state.commands
+        _batch_state.commands = None
+        self.win.autoflush = self.autoflush
+        if self.autoflush:
+            batch.append(_root.update)
+        _tkExecMany(batch, wait=True)
+        return False
+
 ############################################################################
 # Graphics classes start here
         
@@ -254,6 +342,7 @@ class GraphWin(tk.Canvas):
         self._mouseCallback = None
         self.trans = None
         self.closed = False
+        self.gridImage = None
         master.lift()
         if autoflush: _root.update()
 
@@ -272,6 +361,18 @@ class GraphWin(tk.Canvas):
         lower-left corner to (x2,y2) in the upper-right corner."""
         self.trans = Transform(self.width, self.height, x1, y1, x2, y2)
 
+    def batch(self):
+        """Return a context manager that groups drawing commands:
+
+           with win.batch():
+               for r in rectangles:
+                   r.draw(win)
+
+        Inside the block, commands are queued instead of being sent to
+        the Tk thread one at a time. They all run together, in order,
+        when the block ends, which waits once for them to finish."""
+        return _TkBatch(self)
+
     def close(self):
         if self.closed: return
         _tkCall(self.__close_help)
@@ -311,6 +412,23 @@ class GraphWin(tk.Canvas):
         self.__checkOpen()
         _tkCall(self.update_idletasks)
         
+    def drawGrid(self, states, palette, scale=1):
+        """Draw a 2D array of cell states into the window as one image.
+        states is indexed [row, column] and each cell becomes a scale x
+        scale block of pixels colored palette[state], where palette is a
+        sequence of [r,g,b] values in range(256). The image is placed at
+        the top-left corner of the window and replaced on every call."""
+        self.__checkOpen()
+        rgb = _asArray(palette, "uint8")[_asArray(states, "intp")]
+        _tkExec(self.__drawGrid_help, _ppmData(rgb, scale))
+        self.__autoflush()
+
+    def __drawGrid_help(self, data):
+        if self.gridImage is None:
+            self.gridImage = tk.PhotoImage(master=_root)
+            self.create_image(0, 0, image=self.gridImage, anchor="nw")
+        _putImageData(self.gridImage, data)
+
     def getMouse(self):
         """Wait for mouse click and return Point object representing
         the click"""
@@ -409,11 +527,28 @@ DEFAULT_CONFIG = {"fill":"",
       "justify":"center",
                   "font": ("helvetica", 12, "normal")}
 
+class _DrawTarget:
+    # A GraphWin as a queued draw sees it: toScreen uses the coordinate
+    #   transform set when draw() was called; everything else is the
+    #   window's own
+
+    def __init__(self, win):
+        self.win = win
+        self.trans = win.trans
+
+    def toScreen(self, x, y):
+        return GraphWin.toScreen(self, x, y)
+
+    def __getattr__(self, name):
+        return getattr(self.win, name)
+
 class GraphicsObject:
 
     """Generic base class for all of the drawable objects"""
     # A subclass of GraphicsObject should override _draw and
     #   and _move methods.
+
+    tagCount = itertools.count()
     
     def __init__(self, options):
         # options is a list of strings indicating which options are
@@ -454,11 +589,34 @@ class GraphicsObject:
         if graphwin.isClosed(): raise GraphicsError("Can't draw to closed window")
         self.canvas = graphwin
         #self.id = self._draw(graphwin, self.config)
-        self.id = _tkCall(self._draw, graphwin, self.config)
+        # id is a canvas tag chosen here, so drawing needs no round-trip
+        #   to the Tk thread to learn the item id
+        self.id = "graphics%d" % next(GraphicsObject.tagCount)
+        # the item is made later, in the Tk thread, from a copy of the
+        #   object and the window coordinates as they are now, so that a
+        #   move or setCoords before it runs is not applied twice
+        _tkExec(self.__draw_help, _DrawTarget(graphwin), self._snapshot(),
+                self.config.copy(), self.id)
         if graphwin.autoflush:
             #_root.update()
             _tkCall(_root.update)
 
+    def __draw_help(self, target, shape, options, tag):
+        item = shape._draw(target, options)
+        target.win.addtag_withtag(tag, item)
+
+    def _snapshot(self):
+        # Copy of the object to draw from: a shallow copy with its points
+        #   (and lists of points) copied, so later moves leave it alone
+        shape = copy(self)
+        for name, value in vars(self).items():
+            if isinstance(value, Point):
+                setattr(shape, name, value.clone())
+            elif isinstance(value, list):
+                setattr(shape, name, [p.clone() if isinstance(p, Point) else p
+                                      for p in value])
+        return shape
+
     def undraw(self):
 
         """Undraw the object (i.e. hide it). Returns silently if the
@@ -747,16 +905,24 @@ class Entry(GraphicsObject):
         p = self.anchor
         x,y = canvas.toScreen(p.x,p.y)
         frm = tk.Frame(canvas.master)
-        self.entry = tk.Entry(frm,
+        # self is the copy made by draw(); the widget belongs to the
+        #   object drawn, and takes its latest colors and font
+        owner = self.owner
+        owner.entry = tk.Entry(frm,
                               width=self.width,
                               textvariable=self.text,
-                              bg = self.fill,
-                              fg = self.color,
-                              font=self.font)
-        self.entry.pack()
+                              bg = owner.fill,
+                              fg = owner.color,
+                              font=owner.font)
+        owner.entry.pack()
         #self.setFill(self.fill)
         return canvas.create_window(x,y,window=frm)
 
+    def _snapshot(self):
+        shape = GraphicsObject._snapshot(self)
+        shape.owner = self
+        return shape
+
     def getText(self):
         return _tkCall(self.text.get)
 
@@ -835,17 +1001,28 @@ class Image(GraphicsObject):
         else:
             self.img = pixmap.image
                 
+    def draw(self, graphwin):
+        # save a reference before the draw is queued, so that an undraw
+        #   right after it finds the entry to remove
+        cached = self.imageId in self.imageCache
+        self.imageCache[self.imageId] = self.img
+        try:
+            GraphicsObject.draw(self, graphwin)
+        except:
+            if not cached:
+                del self.imageCache[self.imageId]
+            raise
+
     def _draw(self, canvas, options):
         p = self.anchor
         x,y = canvas.toScreen(p.x,p.y)
-        self.imageCache[self.imageId] = self.img # save a reference  
         return canvas.create_image(x,y,image=self.img)
     
     def _move(self, dx, dy):
         self.anchor.move(dx,dy)
         
     def undraw(self):
-        del self.imageCache[self.imageId]  # allow gc of tk photoimage
+        self.imageCache.pop(self.imageId, None)  # allow gc of tk photoimage
         GraphicsObject.undraw(self)
 
     def getAnchor(self):
@@ -909,6 +1086,17 @@ class Pixmap:
         """
         
         _tkExec(self.image.put, "{" + color_rgb(*rgbTuple) +"}", (x, y))
+
+    def putArray(self, rgbArray, scale=1, x=0, y=0):
+        """Sets a block of pixels from a height x width x 3 array of r,g,b
+        values in range(256), in a single call to the Tk thread. Each array
+        entry becomes a scale x scale square of pixels, with the top-left
+        one at (x,y).
+
+        """
+
+        data = _ppmData(_asArray(rgbArray, "uint8"), scale)
+        _tkExec(_putImageData, self.image, data, x, y)
         
     def clone(self):
         """Returns a copy of this Pixmap"""
@@ -925,6 +1113,24 @@ class Pixmap:
         _tkExec(self.image.write, filename, format=ext)
 
         
+def _asArray(a, dtype):
+    if np is None:
+        raise GraphicsError("numpy is required for array drawing")
+    return np.asarray(a, dtype=dtype)
+
+def _ppmData(rgb, scale):
+    # Binary PPM image of an rgb array, each pixel repeated into a
+    # scale x scale block
+    if scale != 1:
+        rgb = np.repeat(np.repeat(rgb, scale, axis=0), scale, axis=1)
+    height, width = rgb.shape[:2]
+    header = ("P6 %d %d 255\n" % (width, height)).encode("ascii")
+    return header + np.ascontiguousarray(rgb).tobytes()
+
+def _putImageData(image, data, x=0, y=0):
+    # Must run in the Tk thread
+    image.tk.call(image.name, "put", data, "-format", "ppm", "-to", x, y)
+
 def color_rgb(r,g,b):
     """r,g,b are intensities of red, green, and blue in range(256)
     Returns color specifier string for the resulting color"""
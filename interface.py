@@ -1,6 +1,11 @@
 from graphics import *
+from graphics import _tkCall, _tkExec
+import numpy as np
+import threading
 import time
 import model
+import profiling
+from palette import makePalette
 
 #User-adjustable parameters
 winTitle = "Mushroom Simulation"
@@ -9,53 +14,283 @@ cellWidth = 15
 winDims = (80,20)
 
 # Object variables
-win= GraphWin(width=winDims[0] * cellWidth, height=winDims[1] * cellWidth,title=winTitle)
-win.setBackground('green')
+win = None
+renderer = None
+
+# Opens the interface window, 'dims' cells wide and high
+def openWindow(dims=winDims):
+	global win
+	win= GraphWin(width=dims[0] * cellWidth, height=dims[1] * cellWidth,title=winTitle)
+	win.setBackground('green')
+	return win
+
+# The open window, opened at winDims when there is none
+def _window():
+	if win is None or win.isClosed():
+		openWindow()
+	return win
+
+# Simulation viewer, for use with engine.Simulation.attach. Opens a window
+# sized to the grid on first use and redraws the cells that changed.
+def showSimulation(sim):
+	global renderer
+	if win is None or win.isClosed():
+		renderer = GridRenderer(openWindow(sim.shape))
+	renderer(sim)
 
 # Draw state to grid
 def drawState(d, x, y):
 	r = Point(cellWidth * x, cellWidth * y)
 	s = Point(cellWidth * x + cellWidth, cellWidth * y + cellWidth)
 	t = Rectangle(r,s)
-	t.setFill(colorFromState(d))
-	t.draw(win)
-
-# EMPTY: Light Green
-# SPORE: Black
-# YOUNG: Dark Grey
-# MATURING: Light Grey
-# MUSHROOMS: White
-# OLDER: Light Grey
-# DECAYING: Tan
-# DEAD1: Brown
-# DEAD2: Dark Green
-# INERT: Yellow
-def colorFromState(state):
-	if state == model.EMPTY:
-		return color_rgb(0,1,0)
-	if state == model.SPORE:
-		return color_rgb(0,0,0)
-	elif state == model.YOUNG:
-		return color_rgb(0.4,0.4,0.4)
-	elif state == model.MATURING or state == model.OLDER:
-		return color_rgb(0.8,0.8,0.8)
-	elif state == model.MUSHROOMS:
-		return color_rgb(1,1,1)
-	elif state == model.DECAYING:
-		return color_rgb(1,1,0.5)
-	elif state == model.DEAD1:
-		return color_rgb(.5,.5,0)
-	elif state == model.DEAD2:
-		return color_rgb(0,0.5,0)
-	elif state == model.INERT:
-		return color_rgb(1,1,0)
-
-
-# Runs an animation given a timestep value
-def animate(t):
-	while(True):
-		start = time.time()
-
-		end = time.time()
-		time.sleep(t - (end - start))
-	return
\ No newline at end of file
+	t.setFill(model.colorFromState(d))
+	t.draw(_window())
+
+class GridRenderer:
+
+	"""Draws a grid of cell states into a GraphWin, one rectangle per cell.
+
+	The rectangles are created once, on the first frame. Every later frame
+	is diffed against the previous one and only the cells whose state
+	changed are recolored, all in a single call to the Tk thread, so the
+	cost of a frame follows the activity on the grid rather than its area.
+	A GridRenderer can be attached to an engine.Simulation as a viewer.
+	palette is anything palette.makePalette takes, model.colorScheme by
+	default.
+	"""
+
+	def __init__(self, win, cellWidth=cellWidth, palette=None):
+		self.win = win
+		self.cellWidth = cellWidth
+		self.colors = makePalette(model.colorScheme if palette is None else palette).hex
+		self.ids = None
+		self.grid = None
+
+	def __call__(self, sim):
+		self.draw(sim.grid)
+
+	def draw(self, grid):
+		"""Show grid, recoloring only the cells that changed"""
+		if self.win.isClosed():
+			raise GraphicsError("Can't draw to closed window")
+		grid = np.array(grid, dtype=np.intp)
+		if self.ids is None or self.grid.shape != grid.shape:
+			self.clear()
+			self.ids = _tkCall(self._create, grid)
+			if self.ids is None:
+				raise GraphicsError("Can't draw to closed window")
+		else:
+			changed = np.nonzero(grid != self.grid)
+			if len(changed[0]) > 0:
+				_tkExec(self._recolor, self.ids[changed].tolist(),
+						grid[changed].tolist())
+		self.grid = grid
+
+	def clear(self):
+		"""Delete the rectangles from the window"""
+		if self.ids is not None and not self.win.isClosed():
+			_tkExec(self.win.delete, *self.ids.ravel().tolist())
+		self.ids = None
+		self.grid = None
+
+	def _create(self, grid):
+		# Runs in the Tk thread. Returns the item ids as an array shaped
+		# like the grid, or None when the window has been closed.
+		if self.win.isClosed():
+			return None
+		w = self.cellWidth
+		ids = np.zeros(grid.shape, dtype=np.intp)
+		for x in range(grid.shape[0]):
+			for y in range(grid.shape[1]):
+				ids[x, y] = self.win.create_rectangle(
+					w * x, w * y, w * x + w, w * y + w,
+					fill=self.colors[grid[x, y]], outline="black")
+		return ids
+
+	def _recolor(self, ids, states):
+		# Runs in the Tk thread. Goes through tk.call directly, since
+		# Canvas.itemconfig rebuilds its option list on every call. The
+		# window may have been closed since the caller checked; an error
+		# here would stop the Tk thread.
+		if self.win.isClosed():
+			return
+		call = self.win.tk.call
+		widget = self.win._w
+		colors = self.colors
+		for i, state in zip(ids, states):
+			call(widget, 'itemconfigure', i, '-fill', colors[state])
+
+
+class ImageGridRenderer:
+
+	"""Draws a grid of cell states into a GraphWin as a single image.
+
+	For grids too large for one canvas item per cell. Every frame is one
+	palette lookup over the whole grid and one image upload to the Tk
+	thread, with each cell scaled up to cellWidth x cellWidth pixels.
+	palette is as for GridRenderer.
+	"""
+
+	def __init__(self, win, cellWidth=cellWidth, palette=None):
+		self.win = win
+		self.cellWidth = cellWidth
+		self.palette = makePalette(model.colorScheme if palette is None else palette).rgb
+
+	def __call__(self, sim):
+		self.draw(sim.grid)
+
+	def draw(self, grid):
+		"""Show grid"""
+		# Grids are indexed [x, y], images [row, column]
+		self.win.drawGrid(np.asarray(grid).T, self.palette, self.cellWidth)
+
+
+class Animation:
+
+	"""Runs a Simulation in a worker thread and shows it at a fixed rate.
+
+	The simulation steps as fast as it can (or at stepsPerSecond) and
+	publishes a copy of every new grid. run() draws the latest one with
+	renderer (anything with a draw(grid) method, e.g. GridRenderer) fps
+	times a second; the grids stepped between two frames are never drawn,
+	so a slow redraw drops frames instead of slowing the simulation.
+
+	pause(), resume(), stepOnce() and setSpeed() may be called from any
+	thread, e.g. a mouse handler, while run() is going. The viewers
+	attached to the simulation still see every step, in the worker thread.
+	"""
+
+	def __init__(self, sim, renderer, fps=30, stepsPerSecond=None):
+		self.sim = sim
+		self.renderer = renderer
+		self.fps = fps
+		self.stepsPerSecond = stepsPerSecond
+		self.condition = threading.Condition()
+		self.paused = False
+		self.pendingSteps = 0
+		self.stopped = False
+		self.lastStep = None
+		self.error = None
+		self.latest = None
+		self.mushrooms = []
+		self.framesShown = 0
+		self.framesDropped = 0
+
+	def pause(self):
+		with self.condition:
+			self.paused = True
+			self.condition.notify_all()
+
+	def resume(self):
+		with self.condition:
+			self.paused = False
+			self.pendingSteps = 0
+			self.condition.notify_all()
+
+	def stepOnce(self):
+		"""Pause, then advance the simulation by a single step"""
+		with self.condition:
+			self.paused = True
+			self.pendingSteps += 1
+			self.condition.notify_all()
+
+	def setSpeed(self, stepsPerSecond):
+		"""Limit the simulation to stepsPerSecond (None for no limit)"""
+		with self.condition:
+			self.stepsPerSecond = stepsPerSecond
+			self.condition.notify_all()
+
+	def stop(self):
+		with self.condition:
+			self.stopped = True
+			self.condition.notify_all()
+
+	def run(self, numSteps=None):
+		"""Run numSteps steps (until stop() when None), showing the
+		simulation until the last one is drawn or the window is closed.
+		Returns the number of mushrooms after each step taken."""
+		self.stopped = False
+		self.latest = (self.sim.steps, np.array(self.sim.grid))
+		worker = threading.Thread(target=self._simulate, args=(numSteps,), daemon=True)
+		worker.start()
+		win = getattr(self.renderer, "win", None)
+		shown = None
+		deadline = time.perf_counter()
+		try:
+			while win is None or not win.isClosed():
+				finished = not worker.is_alive()
+				step, grid = self.latest
+				if step != shown:
+					if shown is not None:
+						self.framesDropped += step - shown - 1
+					self._show(grid)
+					shown = step
+				if finished:
+					break
+				# Keep to the frame times; after falling behind, start again
+				# from now rather than rushing to catch up
+				deadline += 1 / self.fps
+				delay = deadline - time.perf_counter()
+				if delay > 0:
+					time.sleep(delay)
+				else:
+					deadline = time.perf_counter()
+		finally:
+			self.stop()
+			worker.join()
+		if self.error is not None:
+			error, self.error = self.error, None
+			raise error
+		return np.array(self.mushrooms, dtype=float)
+
+	# Draws grid and waits for Tk to show it, so frames are not queued
+	# faster than Tk can draw them
+	def _show(self, grid):
+		profiler = profiling.active
+		start = time.perf_counter()
+		self.renderer.draw(grid)
+		win = getattr(self.renderer, "win", None)
+		if win is not None:
+			win.flush()
+		self.framesShown += 1
+		if profiler is not None:
+			profiler.add("render", time.perf_counter() - start)
+
+	# Worker thread: steps the simulation and publishes every new grid
+	def _simulate(self, numSteps):
+		try:
+			taken = 0
+			while (numSteps is None or taken < numSteps) and self._waitForStep():
+				self.sim.step()
+				taken += 1
+				self.mushrooms.append(self.sim.numMushrooms)
+				self.latest = (self.sim.steps, self.sim.grid.copy())
+		except Exception as e:
+			self.error = e
+
+	# Blocks until the next step may be taken: not paused (or a single step
+	# is pending) and not ahead of stepsPerSecond. False once stopped.
+	def _waitForStep(self):
+		with self.condition:
+			while not self.stopped:
+				if self.paused:
+					if self.pendingSteps > 0:
+						self.pendingSteps -= 1
+						return True
+					self.condition.wait()
+					continue
+				if self.stepsPerSecond is None:
+					return True
+				now = time.perf_counter()
+				due = now if self.lastStep is None else self.lastStep + 1 / self.stepsPerSecond
+				if now >= due:
+					self.lastStep = now
+					return True
+				self.condition.wait(due - now)
+			return False
+
+
+# Shows 'sim' through 'renderer' at 'fps' frames per second for numSteps
+# steps, with the simulation running in a worker thread (see Animation)
+def animate(sim, renderer, numSteps=None, fps=30, stepsPerSecond=None):
+	return Animation(sim, renderer, fps, stepsPerSecond).run(numSteps)
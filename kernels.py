@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+'''
+Compiled per-cell backend for the mushroom model.
+
+changeStates is changeState from model.py run as one loop over the grid,
+row by row, keeping its sequential side effects: probSpore is a running
+value that MUSHROOMS cells do not update, numMushrooms is counted cell by
+cell and the random walk of randomSpread is taken step by step. It is
+compiled with numba when numba is installed and runs as plain Python
+otherwise.
+
+Grid edges follow the boundary modes of engine.py; with "legacy" the
+neighborhoods are exactly the slices changeState takes.
+
+All random numbers are drawn in bulk before the loop and handed to the
+kernel, so the compiled and the pure Python kernels give identical grids for
+the same seed.
+'''
+
+import numpy as np
+import profiling
+from streams import replicateGenerators
+from engine import EMPTY, SPORE, YOUNG, MATURING, MUSHROOMS, OLDER, \
+    DECAYING, DEAD1, DEAD2, INERT, BOUNDARIES
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+HAVE_NUMBA = numba is not None
+
+
+# Index k along an axis of length 'size' mapped onto the grid for boundary
+# mode number 'boundary' (its position in engine.BOUNDARIES), or -1 when it
+# stands for nothing
+def _wrapPython(k, size, boundary):
+    if 0 <= k < size:
+        return k
+    if boundary == 3:
+        return k % size
+    if boundary == 2:
+        return 0 if k < 0 else size - 1
+    return -1
+
+
+if HAVE_NUMBA:
+    _wrap = numba.njit(cache=True)(_wrapPython)
+else:
+    _wrap = _wrapPython
+
+
+# changeState for every cell of 'copyGrid', writing into 'grid'.
+# 'uniforms' holds two uniform draws per cell: the first for the SPORE and
+# spore spawn checks, the second for the MATURING and spread checks.
+# 'walkBits' holds the random walk steps of each cell, one bit per step,
+# x steps in walkBits[i, j, 0] and y steps in walkBits[i, j, 1].
+# 'boundary' is the number of the boundary mode in engine.BOUNDARIES.
+# Returns the final (probSpore, numMushrooms).
+def changeStatesPython(copyGrid, grid, uniforms, walkBits, probSpore, numMushrooms,
+                       probSporeToHyphae, probMushroom, probSpread,
+                       mushroomSporeSpawnRule, spreadRule, randWalkDist,
+                       numRandWalkSteps, mushroomSpreadRule, boundary):
+    m, n = copyGrid.shape
+    for i in range(m):
+        for j in range(n):
+            state = copyGrid[i, j]
+            # With legacy edges the first row and column see no neighbors,
+            # as copyGrid[-1:2] is an empty slice
+            sees = boundary != 0 or (i > 0 and j > 0)
+
+            # Neighboring mushrooms in rows i - 1:i + 1, columns j - 1:j + 1
+            if mushroomSporeSpawnRule == 1 and state != MUSHROOMS:
+                count = 0
+                if sees:
+                    for a in range(i - 1, i + 1):
+                        for b in range(j - 1, j + 1):
+                            a2 = _wrap(a, m, boundary)
+                            b2 = _wrap(b, n, boundary)
+                            if a2 >= 0 and b2 >= 0 and copyGrid[a2, b2] == MUSHROOMS:
+                                count += 1
+                probSpore = count / 8
+
+            if state == SPORE:
+                if uniforms[i, j, 0] < probSporeToHyphae:
+                    grid[i, j] = YOUNG
+
+            elif uniforms[i, j, 0] < probSpore and state != INERT:
+                grid[i, j] = SPORE
+
+            elif state == YOUNG:
+                grid[i, j] = MATURING
+
+            elif state == MATURING:
+                if uniforms[i, j, 1] < probMushroom:
+                    grid[i, j] = MUSHROOMS
+                    if mushroomSporeSpawnRule == 0:
+                        numMushrooms += 1
+                else:
+                    grid[i, j] = OLDER
+
+            elif state == MUSHROOMS or state == OLDER:
+                grid[i, j] = DECAYING
+                if mushroomSporeSpawnRule == 0 and state == MUSHROOMS:
+                    numMushrooms -= 1
+
+            elif state == DECAYING:
+                grid[i, j] = DEAD1
+
+            elif state == DEAD1:
+                grid[i, j] = DEAD2
+
+            elif state == DEAD2:
+                grid[i, j] = EMPTY
+
+            elif state == EMPTY:
+                # isNeighborYoung over rows i - 1:i + 2, columns j - 1:j + 2
+                spread = 0.0
+                if spreadRule == 0:
+                    young = 0
+                    if sees:
+                        for a in range(i - 1, i + 2):
+                            for b in range(j - 1, j + 2):
+                                a2 = _wrap(a, m, boundary)
+                                b2 = _wrap(b, n, boundary)
+                                if a2 >= 0 and b2 >= 0 and copyGrid[a2, b2] == YOUNG:
+                                    young += 1
+                    if mushroomSpreadRule == 0 and young > 0:
+                        spread = probSpread
+                    elif mushroomSpreadRule == 1:
+                        spread = young / 8.0
+
+                if spreadRule == 0 and uniforms[i, j, 1] < spread:
+                    grid[i, j] = YOUNG
+                else:
+                    # randomSpread
+                    sumX = 0
+                    sumY = 0
+                    for s in range(numRandWalkSteps):
+                        word = s // 64
+                        shift = np.uint64(s % 64)
+                        if (walkBits[i, j, 0, word] >> shift) & np.uint64(1):
+                            sumX += 1
+                        else:
+                            sumX -= 1
+                        if (walkBits[i, j, 1, word] >> shift) & np.uint64(1):
+                            sumY += 1
+                        else:
+                            sumY -= 1
+                    if np.sqrt(sumX ** 2 + sumY ** 2) >= randWalkDist:
+                        grid[i, j] = YOUNG
+
+    return probSpore, numMushrooms
+
+
+if HAVE_NUMBA:
+    changeStates = numba.njit(cache=True)(changeStatesPython)
+else:
+    changeStates = changeStatesPython
+
+
+# Random numbers of one step of an m x n grid: two uniforms per cell and
+# the bits of its random walks
+def _draws(rng, m, n, words):
+    uniforms = rng.random((m, n, 2))
+    walkBits = rng.bit_generator.random_raw((m, n, 2, max(words, 1)))
+    return uniforms, walkBits
+
+
+# Drop-in replacement for engine.stepGrid running the per-cell kernel.
+# 'compiled' selects the numba kernel (when installed) or plain Python.
+# Stacks of grids are stepped one grid at a time, each with its own stream
+# when rng is a streams.StackedGenerator.
+def stepGridCompiled(grid, rng, probSpore=0, numMushrooms=0,
+                     probSporeToHyphae=0.6, probMushroom=0.6, probSpread=0.6,
+                     mushroomSporeSpawnRule=1, spreadRule=0, randWalkDist=20,
+                     numRandWalkSteps=40, mushroomSpreadRule=0, boundary="legacy",
+                     out=None, compiled=True):
+    kernel = changeStates if compiled else changeStatesPython
+    m, n = grid.shape[-2:]
+    stack = grid.shape[:-2]
+    copyGrids = grid.reshape((-1, m, n))
+    if out is None:
+        new = copyGrids.copy()
+    else:
+        new = out.reshape((-1, m, n))
+        new[...] = copyGrids
+    probSpores = np.array(np.broadcast_to(probSpore, stack), dtype=float).reshape(-1)
+    counts = np.array(np.broadcast_to(numMushrooms, stack)).reshape(-1)
+    words = -(-numRandWalkSteps // 64)
+    generators = replicateGenerators(rng, len(copyGrids))
+    for k in range(len(copyGrids)):
+        if profiling.active is None:
+            uniforms, walkBits = _draws(generators[k], m, n, words)
+        else:
+            with profiling.active.timer("rng"):
+                uniforms, walkBits = _draws(generators[k], m, n, words)
+        probSpores[k], counts[k] = kernel(
+            copyGrids[k], new[k], uniforms, walkBits, probSpores[k], counts[k],
+            probSporeToHyphae, probMushroom, probSpread,
+            mushroomSporeSpawnRule, spreadRule, randWalkDist,
+            numRandWalkSteps, mushroomSpreadRule, BOUNDARIES.index(boundary))
+    new = new.reshape(grid.shape) if out is None else out
+    if not stack:
+        return new, probSpores[0], counts[0]
+    return new, probSpores.reshape(stack), counts.reshape(stack)
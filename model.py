@@ -28,23 +28,13 @@ Rayner, Alan D. M. 1991. “Conflicting Flows: The Dynamics of Mycelial Territor
     ality.” McIlvainea, 10: 24-3557-62.
 '''
 
-from graphics import *
-import matplotlib.pyplot as plt
 import numpy as np
-import random
 import time
-
-# Cell States Constant
-EMPTY = 0
-SPORE = 1
-YOUNG = 2
-MATURING = 3
-MUSHROOMS = 4
-OLDER = 5
-DECAYING = 6
-DEAD1 = 7
-DEAD2 = 8
-INERT = 9
+from streams import makeGenerator, replicateSeeds
+from palette import getPalette
+from profiling import Profiler, enableProfiling, disableProfiling
+from engine import EMPTY, SPORE, YOUNG, MATURING, MUSHROOMS, OLDER, \
+    DECAYING, DEAD1, DEAD2, INERT, DEFAULT_PARAMS, Simulation
 
 # Update Probabilities
 probSporeToHyphae = 0.6
@@ -57,7 +47,18 @@ cellWidth = 15
 m = 25
 n = 25
 winDims = (m, n)
-win= GraphWin(width=winDims[0] * cellWidth, height=winDims[1] * cellWidth,title=winTitle)
+
+# Window is only opened once something is drawn, see openWindow.
+win = None
+
+# Renderer used for the simulation window.
+# 0 = One canvas rectangle per cell, recolored when the cell changes
+# 1 = Whole grid drawn as a single image, for large grids
+renderRule = 0
+
+# Colors of the states, by scheme name: "classic", "colorblind", "grayscale"
+# or one added with palette.registerScheme
+colorScheme = "classic"
 
 # Probability of spawning a spore. Used when initializing the grid and then for spawning spores from mushrooms.
 probSpore = 0
@@ -80,6 +81,13 @@ numRandWalkSteps = 40
 # 1 = Dynamic
 mushroomSpreadRule = 0
 
+# Boundary conditions at the grid edges.
+# "absorbing"  = Nothing lies outside the grid
+# "reflecting" = Edge rows and columns are mirrored outwards
+# "periodic"   = Grid wraps around at its edges
+# "legacy"     = Edges of changeState, where the first row and column see no neighbors
+boundary = "legacy"
+
 # Used with spore spawn rule 0 after each timestep to calculate new probSpore value.
 numMushrooms = 0
 
@@ -91,6 +99,51 @@ numTimeSteps = 15
 numSimulations = 1
 initRule = 1
 
+# Worker processes for runs that are not drawn (see ensemble.py), and the
+# seed of the whole set of runs (None for a fresh one every time)
+numWorkers = 1
+seed = None
+
+# Random stream of the per-cell reference functions below (initGrid,
+# randomSpread and changeState). Made from 'seed' when first used, and again
+# whenever seed has changed since; see referenceRng.
+rng = None
+_rngSeed = None
+
+# Number of undrawn runs stepped together as one stack of grids (None for
+# one at a time)
+batchSize = None
+
+# Step function used by the simulations.
+# "numpy"    = Vectorized whole-grid engine (engine.py)
+# "frontier" = Only steps the active cells of mostly empty grids (engine.py)
+# "compiled" = Per-cell kernel with changeState's exact semantics (kernels.py)
+# "strips"   = Large grids split into strips stepped on all cores (strips.py)
+backend = "numpy"
+
+# Frames per second of drawn runs. The simulation steps in a worker thread
+# and the window shows its latest grid at this rate, skipping the grids in
+# between (see interface.Animation). None draws every step, stepping and
+# drawing in turn.
+frameRate = 30
+
+# Steps per second of drawn runs (None for as fast as possible)
+stepsPerSecond = None
+
+# Timers and counters for the drawn runs (see profiling.py), with a log line
+# of the averages every 'profileLogEvery' steps (None for no log)
+profile = False
+profileLogEvery = 10
+
+# Stream of the reference functions, made from the current 'seed' when
+# there is none yet or seed has changed since it was made
+def referenceRng():
+    global rng, _rngSeed
+    if rng is None or seed != _rngSeed:
+        rng = makeGenerator(seed)
+        _rngSeed = seed
+    return rng
+
 # Method to initialize a starting grid
 # RANDOM    = 0
 # SINGLE    = 1
@@ -100,11 +153,11 @@ def initGrid(t):
 
     # Randomly placed spores, using probSpore
     if t == 0:
-        return np.random.choice(a=[SPORE, EMPTY], size=winDims, p=[probSpore, 1-probSpore])
+        return referenceRng().choice(a=[SPORE, EMPTY], size=winDims, p=[probSpore, 1-probSpore]).astype(np.uint8)
 
     # Single spore in middle of grid
     elif t == 1:
-        grid = np.ones(winDims) * EMPTY
+        grid = np.full(winDims, EMPTY, dtype=np.uint8)
         x = (int) (m / 2)
         y = (int) (n / 2)
         grid[x, y] = SPORE
@@ -112,7 +165,7 @@ def initGrid(t):
 
     # Two spores separating two quarters of the grid
     elif t == 2:
-        grid = np.ones(winDims) * EMPTY
+        grid = np.full(winDims, EMPTY, dtype=np.uint8)
         x = (int) (m / 4)
         y = (int) (n / 2)
         grid[x, y] = SPORE
@@ -121,7 +174,7 @@ def initGrid(t):
 
     # Single spore and impermeable barrier around grid
     elif t == 3:
-        grid = np.ones(winDims) * EMPTY
+        grid = np.full(winDims, EMPTY, dtype=np.uint8)
         x = (int) (m / 2)
         y = (int) (n / 2)
         grid[x, y] = SPORE
@@ -136,7 +189,7 @@ def initGrid(t):
 
     #single spore and a clump of INERT barriers on the other side of grid
     elif t == 4:
-        grid = np.ones(winDims) * EMPTY
+        grid = np.full(winDims, EMPTY, dtype=np.uint8)
         x = (int) (m / 2)
         y = (int) (n / 2)
         grid[x, y] = SPORE
@@ -152,39 +205,34 @@ def initGrid(t):
 # similar to how mycelium actually spreads.
 # 'dist' is the minimum linear distance required for spread from a center point.
 # 'numTrials' is the number of random walks to generate before returning.
+# Each axis of the walk is a sum of 'numTrials' steps of -1 or +1, so its
+# endpoint is sampled directly as 2 * Binomial(numTrials, 1/2) - numTrials.
 def randomSpread(dist, numTrials):
-    sumX = 0
-    sumY = 0
-    for i in range(numTrials):
-        x = np.random.randint(2)
-        y = np.random.randint(2)
-        if not x:
-            sumX -= 1
-        else:
-            sumX += 1
-        if not y:
-            sumY -= 1
-        else:
-            sumY += 1
+    rng = referenceRng()
+    sumX = 2 * rng.binomial(numTrials, 0.5) - numTrials
+    sumY = 2 * rng.binomial(numTrials, 0.5) - numTrials
     return np.sqrt(sumX**2 + sumY**2) >= dist
 
 # State diagram on p. 717
+# Per-cell reference implementation of the rules. The main loop uses the
+# vectorized engine.stepGrid, which follows the same transition probabilities.
 def changeState(copyGrid, i, j):
     global probSpore
     global numMushrooms
+    rng = referenceRng()
 
     # Check if neighbor cells have mushrooms and update spore spawn probability.
     if mushroomSporeSpawnRule == 1 and copyGrid[i,j] != MUSHROOMS:
         probSpore = (copyGrid[i - 1:i + 1,j - 1:j + 1] == MUSHROOMS).sum() / 8
 
     if copyGrid[i,j] == SPORE:
-        if random.random() < probSporeToHyphae:
+        if rng.random() < probSporeToHyphae:
             grid[i, j] = YOUNG
 
     # Modification of state diagram to include spawning of new spores on
     # any kind of ground except inert ground. Code branch applies to both
     # spore spawn rules.
-    elif random.random() < probSpore and copyGrid[i,j] != INERT:
+    elif rng.random() < probSpore and copyGrid[i,j] != INERT:
         grid[i,j] = SPORE
 
     # Turn all young hyphae into maturing hyphae after a single timestep
@@ -193,7 +241,7 @@ def changeState(copyGrid, i, j):
 
     # A maturing hyphae has the chance of fruiting a mushroom. Otherwise, it ages.
     elif copyGrid[i,j] == MATURING:
-        if random.random() < probMushroom:
+        if rng.random() < probMushroom:
             grid[i, j] = MUSHROOMS
 
             # Increment mushroom counter if spore spawning is based on mushroom count.
@@ -224,7 +272,7 @@ def changeState(copyGrid, i, j):
     elif copyGrid[i,j] == EMPTY:
 
         # Use probSpread probability
-        if spreadRule == 0 and random.random() < isNeighborYoung(copyGrid,i,j):
+        if spreadRule == 0 and rng.random() < isNeighborYoung(copyGrid,i,j):
             grid[i, j] = YOUNG
         elif randomSpread(randWalkDist, numRandWalkSteps):
             grid[i, j] = YOUNG
@@ -243,91 +291,98 @@ def isNeighborYoung(copyGrid,i, j):
     else:
         return 0
 
+# Opens the simulation window on first use. Importing graphics starts the
+# Tk thread, so headless runs never do it.
+def openWindow():
+	global win
+	if win is None or win.isClosed():
+		from graphics import GraphWin
+		win = GraphWin(width=winDims[0] * cellWidth, height=winDims[1] * cellWidth,title=winTitle)
+	return win
+
 # Draw state to grid
 def drawState(d, x, y):
+	from graphics import Point, Rectangle
 	r = Point(cellWidth * x, cellWidth * y)
 	s = Point(cellWidth * x + cellWidth, cellWidth * y + cellWidth)
 	t = Rectangle(r,s)
 	t.setFill(colorFromState(d))
-	t.draw(win)
-
-# EMPTY: Light Green
-# SPORE: Black
-# YOUNG: Dark Grey
-# MATURING: Light Grey
-# MUSHROOMS: White
-# OLDER: Light Grey
-# DECAYING: Tan
-# DEAD1: Brown
-# DEAD2: Dark Green
-# INERT: Yellow
+	t.draw(openWindow())
+
+# Color of a state in the current color scheme (see palette.py)
 def colorFromState(state):
-	if state == EMPTY:
-		return color_rgb(0,255,0)
-	if state == SPORE:
-		return color_rgb(0,0,0)
-	elif state == YOUNG:
-		return color_rgb(64,64,64)
-	elif state == MATURING or state == OLDER:
-		return color_rgb(192,192,192)
-	elif state == MUSHROOMS:
-		return color_rgb(255,255,255)
-	elif state == DECAYING:
-		return color_rgb(255,255,128)
-	elif state == DEAD1:
-		return color_rgb(128,128,0)
-	elif state == DEAD2:
-		return color_rgb(0,128,0)
-	elif state == INERT:
-		return color_rgb(255,255,0)
+	return getPalette(colorScheme)[state]
+
+# Builds a headless Simulation from the parameters at the top of this module.
+# 'runSeed' seeds its stream; by default it is the first of
+# streams.replicateSeeds(seed, ...), the seed runEnsemble gives its first run.
+def makeSimulation(runSeed=None):
+    if runSeed is None:
+        runSeed = replicateSeeds(seed, 1)[0]
+    params = {name: globals()[name] for name in DEFAULT_PARAMS}
+    return Simulation(m, n, initRule, seed=runSeed, probSpore=probSpore,
+                      backend=backend, **params)
+
+# Runs 'numSimulations' sims of 'numTimeSteps' steps and returns the number
+# of mushrooms at each step of each simulation. 'viewer' shows every run
+# when given: at 'frameRate' through an interface.Animation, for which it
+# needs a draw(grid) method as the renderers have, or attached to the run.
+# Otherwise the runs are spread over 'numWorkers' processes.
+def runSimulations(viewer=None):
+    if viewer is None:
+        from ensemble import runEnsemble
+        params = {name: globals()[name] for name in DEFAULT_PARAMS}
+        return runEnsemble(numSimulations, numTimeSteps, m, n, initRule,
+                           seed=seed, workers=numWorkers, probSpore=probSpore,
+                           batchSize=batchSize, backend=backend, **params)
+
+    # Run s gets the seed runEnsemble gives it, so drawn and undrawn runs of
+    # the same seed agree
+    seeds = replicateSeeds(seed, numSimulations)
+    sims = np.zeros((numSimulations, numTimeSteps))
+    for s in range(numSimulations):
+        sim = makeSimulation(seeds[s])
+        if frameRate is None:
+            sim.attach(viewer)
+            sims[s] = sim.run(numTimeSteps)
+        else:
+            from interface import animate
+            # Closing the window ends the run early
+            mushrooms = animate(sim, viewer, numTimeSteps, frameRate, stepsPerSecond)
+            sims[s, :len(mushrooms)] = mushrooms
+    return sims
 
-# Main program
+# Mushroom count analysis
+def plotMushrooms(sims):
+    import matplotlib.pyplot as plt
 
-# Number of mushrooms at each step of each simulation
-sims = np.zeros((numSimulations, numTimeSteps))
-# Run 'numSimulations' sims
-for s in range(numSimulations):
-    grid = initGrid(initRule)
-    numMushrooms = 0
-
-    #Start by drawing initial state
-    for i in range(m):
-            for j in range(n):
-                drawState(grid[i,j], i, j)
-
-    # Configure spore spawning after initial grid is made
-    probSpore = 0
-
-    # Store the number of mushrooms at each time step
-    mushrooms = np.zeros(numTimeSteps)
-
-    # Draw each state change for k number of timesteps
-    for k in range(numTimeSteps):
-        copyGrid = np.copy(grid)
-        for i in range(m):
-            for j in range(n):
-                changeState(copyGrid, i, j)
-                drawState(grid[i,j], i, j)
-        mushrooms[k] = numMushrooms
-
-
-        # Calculate spore spawn probability and reset mushroom counter.
-        # Only used with spore spawn rule 0
-        if mushroomSporeSpawnRule == 0:
-            probSpore = numMushrooms / (m * n)
-            #numMushrooms = 0
-    # Add current run to array of all sims
-    sims[s] = mushrooms
+    # Get average number of mushrooms at each step across all sims
+    data = np.mean(sims, axis=0)
 
-# Mushroom count analysis
-data = np.zeros(numTimeSteps)
-# Get average number of mushrooms at each step across all sims
-for i in range(numTimeSteps):
-    data[i] = np.sum(sims[:,i]) / numSimulations
-
-plt.plot(data)
-plt.xlabel("Time step")
-plt.ylabel("Number of mushrooms")
-plt.text(0.75 * numTimeSteps, 0.1 * np.max(data), "t="+str(initRule))
-plt.axes([0, numTimeSteps, 0, np.max(data)])
-plt.show()
+    plt.plot(data)
+    plt.xlabel("Time step")
+    plt.ylabel("Number of mushrooms")
+    plt.text(0.75 * numTimeSteps, 0.1 * np.max(data), "t="+str(initRule))
+    plt.axes([0, numTimeSteps, 0, np.max(data)])
+    plt.show()
+
+# Main program
+def main():
+    from interface import GridRenderer, ImageGridRenderer
+    if renderRule == 0:
+        renderer = GridRenderer(openWindow(), cellWidth, colorScheme)
+    else:
+        renderer = ImageGridRenderer(openWindow(), cellWidth, colorScheme)
+    if not profile:
+        plotMushrooms(runSimulations(viewer=renderer))
+        return
+
+    profiler = enableProfiling(Profiler(logEvery=profileLogEvery))
+    sims = runSimulations(viewer=renderer)
+    with profiler.timer("plot"):
+        plotMushrooms(sims)
+    disableProfiling()
+    print(profiler.stats())
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+'''
+Colors of the cell states, shared by every renderer and exporter.
+
+A Palette holds one color per state twice over: as "#rrggbb" strings
+(hex), for the Tk canvas items of GridRenderer and drawState, and as a
+(NUM_STATES, 3) uint8 RGB table (rgb), for whole-grid images, where the
+colors of a grid are the single lookup palette.rgb[grid].
+
+    palette = makePalette("colorblind")
+    palette = makePalette({INERT: (90, 90, 90)})   # classic, INERT changed
+    registerScheme("mine", [(0, 255, 0), (0, 0, 0), ...])
+
+Schemes list the colors in state order, EMPTY to INERT. The "classic"
+scheme is the one of the original model:
+
+EMPTY: Light Green
+SPORE: Black
+YOUNG: Dark Grey
+MATURING: Light Grey
+MUSHROOMS: White
+OLDER: Light Grey
+DECAYING: Tan
+DEAD1: Brown
+DEAD2: Dark Green
+INERT: Yellow
+
+Nothing here imports graphics, so palettes are available headless.
+'''
+
+import numpy as np
+from engine import NUM_STATES
+
+SCHEMES = {
+    "classic": ((0, 255, 0), (0, 0, 0), (64, 64, 64), (192, 192, 192),
+                (255, 255, 255), (192, 192, 192), (255, 255, 128),
+                (128, 128, 0), (0, 128, 0), (255, 255, 0)),
+    # Okabe-Ito colors, told apart with every common color vision deficiency
+    "colorblind": ((247, 247, 247), (0, 0, 0), (0, 114, 178), (86, 180, 233),
+                   (213, 94, 0), (86, 180, 233), (240, 228, 66),
+                   (230, 159, 0), (204, 121, 167), (0, 158, 115)),
+    "grayscale": ((255, 255, 255), (0, 0, 0), (48, 48, 48), (96, 96, 96),
+                  (160, 160, 160), (96, 96, 96), (192, 192, 192),
+                  (216, 216, 216), (236, 236, 236), (128, 128, 128)),
+}
+
+DEFAULT_SCHEME = "classic"
+
+
+# Color specifier of r,g,b intensities in range(256), as graphics.color_rgb
+def hexColor(r, g, b):
+    return "#%02x%02x%02x" % (r, g, b)
+
+
+# r,g,b of a color given as (r, g, b) or "#rrggbb"
+def _rgb(color):
+    if isinstance(color, str):
+        if len(color) != 7 or color[0] != "#":
+            raise ValueError("colors must be (r, g, b) or '#rrggbb', not %r" % (color,))
+        return tuple(int(color[k:k + 2], 16) for k in (1, 3, 5))
+    r, g, b = (int(c) for c in color)
+    if not all(0 <= c < 256 for c in (r, g, b)):
+        raise ValueError("color intensities must be in range(256): %r" % (color,))
+    return r, g, b
+
+
+class Palette:
+
+    """One color per cell state, as hex strings and as an RGB table.
+
+    colors holds NUM_STATES colors in state order, each (r, g, b) with
+    intensities in range(256) or a "#rrggbb" string.
+    """
+
+    def __init__(self, colors):
+        colors = [_rgb(color) for color in colors]
+        if len(colors) != NUM_STATES:
+            raise ValueError("a palette needs %d colors, not %d" % (NUM_STATES, len(colors)))
+        self.rgb = np.array(colors, dtype=np.uint8)
+        self.rgb.flags.writeable = False
+        self.hex = tuple(hexColor(*color) for color in colors)
+
+    def __getitem__(self, state):
+        return self.hex[state]
+
+    def __len__(self):
+        return NUM_STATES
+
+    def image(self, grid):
+        """RGB array of grid, shaped grid.shape + (3,)"""
+        return self.rgb[grid]
+
+
+_palettes = {}
+
+
+# Adds (or replaces) the scheme 'name' with 'colors', in state order
+def registerScheme(name, colors):
+    SCHEMES[name] = tuple(_rgb(color) for color in colors)
+    _palettes.pop(name, None)
+
+
+# The Palette of scheme 'name', built once
+def getPalette(name=DEFAULT_SCHEME):
+    if name not in _palettes:
+        if name not in SCHEMES:
+            raise ValueError("unknown color scheme %r" % (name,))
+        _palettes[name] = Palette(SCHEMES[name])
+    return _palettes[name]
+
+
+# Palette from any of: a Palette, a scheme name, None (the default scheme),
+# a dict of state -> color overriding the default scheme, a sequence of
+# colors in state order (e.g. an RGB table) or a colorFromState-style
+# function of the state giving "#rrggbb"
+def makePalette(colors=None):
+    if isinstance(colors, Palette):
+        return colors
+    if colors is None or isinstance(colors, str):
+        return getPalette(colors or DEFAULT_SCHEME)
+    if isinstance(colors, dict):
+        merged = list(SCHEMES[DEFAULT_SCHEME])
+        for state, color in colors.items():
+            merged[state] = color
+        return Palette(merged)
+    if callable(colors):
+        return Palette([colors(state) for state in range(NUM_STATES)])
+    return Palette(colors)
@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+'''
+Timers and counters for the hot paths of the model.
+
+While a Profiler is enabled, the simulation loop and the Tk thread report
+to it:
+
+    "step"          time in the step function (state updates and draws)
+    "rng"           time drawing random numbers, part of "step"
+    "view <name>"   time in each viewer, e.g. the renderers
+    "plot"          time plotting the results (model.main)
+    "tkPump"        time the Tk thread spends running queued requests
+
+and count "steps", "cellsEvaluated", "cellsChanged", "tkCommands" (requests
+run by the Tk thread) and "tkRoundTrips" (those a caller waited on).
+
+    profiler = enableProfiling(Profiler(logEvery=100))
+    sim.run(1000)
+    disableProfiling()
+    profiler.stats()
+
+Nothing is timed or counted while no profiler is enabled: the hooks only
+look at profiling.active, once per step or per batch of Tk requests.
+Profiling is per process, so it does not see runs spread over processes by
+ensemble.runEnsemble.
+'''
+
+from contextlib import contextmanager
+import threading
+import time
+
+# The enabled Profiler, or None
+active = None
+
+
+# Enables 'profiler' (a new one when None) and returns it
+def enableProfiling(profiler=None):
+    global active
+    active = profiler if profiler is not None else Profiler()
+    return active
+
+
+def disableProfiling():
+    global active
+    active = None
+
+
+class Profiler:
+
+    """Accumulated time per phase and totals per counter.
+
+    With logEvery, every logEvery steps a line with the averages per step
+    since the last line goes to log. Timers and counters may be updated
+    from several threads.
+    """
+
+    def __init__(self, logEvery=None, log=print):
+        self.logEvery = logEvery
+        self.log = log
+        self.lock = threading.Lock()
+        self.seconds = {}
+        self.calls = {}
+        self.counters = {}
+        self.logged = ({}, {})
+
+    def add(self, name, seconds):
+        """Add seconds spent in phase name"""
+        with self.lock:
+            self.seconds[name] = self.seconds.get(name, 0.0) + seconds
+            self.calls[name] = self.calls.get(name, 0) + 1
+
+    def count(self, name, amount=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    @contextmanager
+    def timer(self, name):
+        """Time the block as phase name"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def stepDone(self):
+        """Count a step and write the log line when one is due"""
+        self.count("steps")
+        if self.logEvery and self.counters["steps"] % self.logEvery == 0:
+            self.log(self.report(since=self.logged))
+            with self.lock:
+                self.logged = (dict(self.seconds), dict(self.counters))
+
+    def stats(self):
+        """Timers and counters as a dict: "seconds" and "calls" per phase
+        and "counters" """
+        with self.lock:
+            return {"seconds": dict(self.seconds), "calls": dict(self.calls),
+                    "counters": dict(self.counters)}
+
+    def report(self, since=({}, {})):
+        """One line of averages per step, from the totals after 'since', a
+        (seconds, counters) pair of earlier totals"""
+        with self.lock:
+            seconds = {name: total - since[0].get(name, 0.0)
+                       for name, total in self.seconds.items()}
+            counters = {name: total - since[1].get(name, 0)
+                        for name, total in self.counters.items()}
+        steps = counters.pop("steps", 0)
+        per = max(steps, 1)
+        parts = ["%d steps" % steps]
+        parts += ["%s %.3g ms" % (name, 1000 * total / per)
+                  for name, total in sorted(seconds.items())]
+        parts += ["%s %.6g" % (name, total / per)
+                  for name, total in sorted(counters.items())]
+        return " | ".join(parts) + " (per step)"
+
+    def reset(self):
+        with self.lock:
+            self.seconds.clear()
+            self.calls.clear()
+            self.counters.clear()
+            self.logged = ({}, {})
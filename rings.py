@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+'''
+Fairy ring geometry of recorded runs.
+
+Measures, for every frame, how the living hyphae (YOUNG, MATURING and
+MUSHROOMS cells by default) are spread around the spores the run started
+from: the radial profile (share of ring cells in each annulus), the mean
+ring radius, the ring thickness, the outer front and the expansion
+velocity. Frames are any array of shape (..., T, m, n), e.g. a stack of
+replicates over time, and every measure is computed for all of them at
+once; trajectory files are read in blocks of frames.
+
+    geometry = analyzeTrajectory("run.traj", initRule=1)
+    geometry["radius"], geometry["velocity"]
+
+Velocities are in cells per frame, so with field growth rates in m/year a
+cell size and a time step give the conversion.
+'''
+
+import numpy as np
+from engine import SPORE, YOUNG, MATURING, MUSHROOMS
+
+RING_STATES = (YOUNG, MATURING, MUSHROOMS)
+
+
+# Positions of the spores initGrid places for 'initRule' on an m x n grid,
+# or those of the SPORE cells of the single grid 'grid' (for initRule 0)
+def sporeCenters(shape=None, initRule=None, grid=None):
+    if grid is not None:
+        return np.argwhere(np.asarray(grid) == SPORE)
+    m, n = shape
+    if initRule in (1, 3, 4):
+        return np.array([[m // 2, n // 2]])
+    if initRule == 2:
+        return np.array([[m // 4, n // 2], [3 * (m // 4), n // 2]])
+    raise ValueError("initRule %r has no fixed spores; pass a starting grid" % (initRule,))
+
+
+class RadialBins:
+
+    """Distance of every cell of an m x n grid to the nearest center, binned.
+
+    binWidth is the width of the annuli in cells. Cells are grouped by bin
+    once, so profiles of any number of frames are one reduction each.
+    """
+
+    def __init__(self, shape, centers, binWidth=1.0):
+        self.shape = tuple(shape)
+        self.binWidth = binWidth
+        i, j = np.indices(self.shape)
+        centers = np.asarray(centers, dtype=float).reshape(-1, 2)
+        if not len(centers):
+            raise ValueError("no centers to measure rings from")
+        distance = np.full(self.shape, np.inf)
+        for ci, cj in centers:
+            distance = np.minimum(distance, np.hypot(i - ci, j - cj))
+        bins = (distance // binWidth).astype(np.intp).reshape(-1)
+        self.order = np.argsort(bins, kind="stable")
+        self.numBins = int(bins.max()) + 1
+        self.cellsPerBin = np.bincount(bins, minlength=self.numBins)
+        # Start of each bin in 'order'
+        self.starts = np.concatenate([[0], np.cumsum(self.cellsPerBin)[:-1]])
+        self.radii = (np.arange(self.numBins) + 0.5) * binWidth
+
+    def counts(self, mask):
+        """Number of cells of mask (..., m, n) in each bin, (..., numBins)"""
+        flat = mask.reshape(mask.shape[:-2] + (-1,))[..., self.order]
+        counts = np.add.reduceat(flat.astype(np.int32), self.starts, axis=-1)
+        # reduceat gives the element at the start for empty bins
+        counts[..., self.cellsPerBin == 0] = 0
+        return counts
+
+
+class StackedBins:
+
+    """RadialBins of every grid of a stack, each around its own centers.
+
+    centers holds one array of centers per grid of a stack whose leading
+    axes (those before T, m, n) are 'lead', in row-major order. The bins of
+    all grids line up: bins past a grid's own last one hold no cells.
+    """
+
+    def __init__(self, shape, centers, lead, binWidth=1.0):
+        self.shape = tuple(shape)
+        self.lead = tuple(lead)
+        self.binWidth = binWidth
+        self.grids = [RadialBins(shape, c, binWidth) for c in centers]
+        if len(self.grids) != int(np.prod(self.lead)):
+            raise ValueError("%d sets of centers for a stack of shape %r"
+                             % (len(self.grids), self.lead))
+        self.numBins = max(bins.numBins for bins in self.grids)
+        self.radii = (np.arange(self.numBins) + 0.5) * binWidth
+        # Shaped (..., 1, numBins) to broadcast over the frames
+        self.cellsPerBin = np.stack([self._pad(bins.cellsPerBin) for bins in self.grids])
+        self.cellsPerBin = self.cellsPerBin.reshape(self.lead + (1, self.numBins))
+
+    def _pad(self, counts):
+        width = [(0, 0)] * (counts.ndim - 1) + [(0, self.numBins - counts.shape[-1])]
+        return np.pad(counts, width)
+
+    def counts(self, mask):
+        """Number of cells of mask (lead..., T, m, n) in each bin,
+        (lead..., T, numBins)"""
+        grids = mask.reshape((-1,) + mask.shape[len(self.lead):])
+        counts = [self._pad(bins.counts(grid)) for bins, grid in zip(self.grids, grids)]
+        return np.stack(counts).reshape(mask.shape[:-2] + (self.numBins,))
+
+
+# Ring measures from the ring cell counts per bin (..., numBins):
+# radius: mean distance of ring cells from the nearest center
+# thickness: ring cells over the circumference at that radius
+# front: outer edge of the annuli with at least 'threshold' ring cells
+def ringMeasures(counts, bins, threshold=0.5):
+    counts = np.asarray(counts, dtype=float)
+    total = counts.sum(axis=-1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        radius = counts @ bins.radii / total
+        thickness = total / (2 * np.pi * radius)
+        share = counts / bins.cellsPerBin
+    filled = share >= threshold
+    last = bins.numBins - 1 - np.argmax(filled[..., ::-1], axis=-1)
+    front = np.where(filled.any(axis=-1), (last + 1) * bins.binWidth, np.nan)
+    return {"radius": radius, "thickness": thickness, "front": front,
+            "cells": total}
+
+
+# Bins around the centers given, those of initRule, or else the spores of
+# each grid of 'first' (..., m, n), the first frame: every replicate of a
+# stack is measured from its own spores.
+def _bins(centers, initRule, first, binWidth):
+    shape = first.shape[-2:]
+    if centers is not None:
+        return RadialBins(shape, centers, binWidth)
+    if initRule not in (None, 0):
+        return RadialBins(shape, sporeCenters(shape, initRule), binWidth)
+    spores = [sporeCenters(grid=grid) for grid in first.reshape((-1,) + shape)]
+    for k, grid in enumerate(spores):
+        if not len(grid):
+            raise ValueError("grid %d of the first frame has no spores; pass "
+                             "centers or initRule" % k)
+    if all(np.array_equal(grid, spores[0]) for grid in spores):
+        return RadialBins(shape, spores[0], binWidth)
+    return StackedBins(shape, spores, first.shape[:-2], binWidth)
+
+
+# Ring geometry of 'frames' (..., T, m, n). Centers come from 'centers',
+# from initRule, or from the SPORE cells of the first frame of each run. Returns a dict of arrays shaped (..., T): radius, thickness,
+# front, cells (number of ring cells) and velocity (change of radius per
+# frame), plus "profile", the share of ring cells in each annulus
+# (..., T, numBins), and "radii", the middle of each annulus.
+def analyzeFrames(frames, centers=None, initRule=None, binWidth=1.0,
+                  states=RING_STATES, threshold=0.5):
+    frames = np.asarray(frames)
+    if frames.ndim < 3:
+        raise ValueError("frames must be shaped (..., T, m, n), not %r" % (frames.shape,))
+    bins = _bins(centers, initRule, frames[..., 0, :, :], binWidth)
+    counts = bins.counts(np.isin(frames, states))
+    return _geometry(counts, bins, threshold)
+
+
+def _geometry(counts, bins, threshold):
+    geometry = ringMeasures(counts, bins, threshold)
+    radius = geometry["radius"]
+    if radius.shape[-1] > 1:
+        geometry["velocity"] = np.gradient(radius, axis=-1)
+    else:
+        geometry["velocity"] = np.full(radius.shape, np.nan)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        geometry["profile"] = counts / bins.cellsPerBin
+    geometry["radii"] = bins.radii
+    return geometry
+
+
+# Ring geometry of a trajectory file (see trajectory.py), read 'block'
+# frames at a time. Same arguments and results as analyzeFrames.
+def analyzeTrajectory(path, centers=None, initRule=None, binWidth=1.0,
+                      states=RING_STATES, threshold=0.5, block=256):
+    from trajectory import TrajectoryReader
+    with TrajectoryReader(path) as reader:
+        bins = _bins(centers, initRule, reader[0], binWidth)
+        # Frames first in the file; time goes after the replicates
+        counts = [bins.counts(np.moveaxis(np.isin(reader[t:t + block], states), 0, -3))
+                  for t in range(0, len(reader), block)]
+    return _geometry(np.concatenate(counts, axis=-2), bins, threshold)
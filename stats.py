@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+'''
+Per-step statistics of a simulation.
+
+StepStats is a viewer that records, after every step, the number of cells
+in each state, from a single np.bincount over the grid, along with any
+extra metrics. Values go into preallocated columns (one array per column,
+grown by doubling), so recording allocates next to nothing per step.
+
+    stats = StepStats(metrics={"radius": RingRadius(), "speed": FrontSpeed(),
+                               "perimeter": youngPerimeter})
+    sim.attach(stats)
+    sim.run(200)
+    stats["MUSHROOMS"], stats["radius"]
+
+Unlike numMushrooms, the state counts are exact under every spore spawn
+rule. For a stack of replicates every column has one value per replicate.
+'''
+
+import numpy as np
+from engine import NUM_STATES, YOUNG
+
+STATE_NAMES = ("EMPTY", "SPORE", "YOUNG", "MATURING", "MUSHROOMS", "OLDER",
+               "DECAYING", "DEAD1", "DEAD2", "INERT")
+
+
+# Number of cells in each state, over the last two axes of 'grid'. One
+# bincount for the whole grid or stack.
+def stateCounts(grid):
+    stack = grid.shape[:-2]
+    if not stack:
+        return np.bincount(grid.reshape(-1), minlength=NUM_STATES)
+    # Give each grid of the stack its own range of bins
+    count = int(np.prod(stack))
+    offsets = np.arange(0, count * NUM_STATES, NUM_STATES).reshape(stack + (1, 1))
+    counts = np.bincount((grid + offsets).reshape(-1), minlength=count * NUM_STATES)
+    return counts.reshape(stack + (NUM_STATES,))
+
+
+# Metric: number of edges between YOUNG cells and other cells, over rows
+# and columns inside the grid; the length of the hyphae front
+def youngPerimeter(sim, counts):
+    young = sim.grid == YOUNG
+    return (np.count_nonzero(young[..., 1:, :] != young[..., :-1, :], axis=(-2, -1))
+            + np.count_nonzero(young[..., :, 1:] != young[..., :, :-1], axis=(-2, -1)))
+
+
+class RingRadius:
+
+    """Metric: mean distance of the YOUNG cells from center.
+
+    center defaults to the middle cell, where initRules 1, 3 and 4 put the
+    first spore. Gives NaN while there are no YOUNG cells.
+    """
+
+    def __init__(self, center=None):
+        self.center = center
+        self.distance = None
+
+    def __call__(self, sim, counts):
+        shape = sim.grid.shape[-2:]
+        if self.distance is None or self.distance.shape != shape:
+            ci, cj = self.center or (shape[0] // 2, shape[1] // 2)
+            i, j = np.ogrid[:shape[0], :shape[1]]
+            self.distance = np.hypot(i - ci, j - cj).astype(np.float32)
+        total = np.sum(np.where(sim.grid == YOUNG, self.distance, 0), axis=(-2, -1))
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return total / counts[..., YOUNG]
+
+
+class FrontSpeed:
+
+    """Metric: change in the ring radius since the previous step.
+
+    Keeps its own RingRadius (or the one given), so the radius does not
+    have to be recorded as well.
+    """
+
+    def __init__(self, radius=None):
+        self.radius = radius or RingRadius()
+        self.previous = None
+
+    def __call__(self, sim, counts):
+        radius = self.radius(sim, counts)
+        speed = radius - self.previous if self.previous is not None else radius * np.nan
+        self.previous = radius
+        return speed
+
+
+class StepStats:
+
+    """Viewer that records per-step state counts and metrics in columns.
+
+    metrics maps column names to callables taking (sim, counts), where
+    counts is the result of stateCounts for the grid, and returning a
+    number (or one per replicate). Columns are "step", the names in
+    STATE_NAMES and the metric names; stats[name] gives the recorded part
+    of a column, with the first axis over the recorded steps.
+    """
+
+    def __init__(self, metrics=None, capacity=256):
+        self.metrics = dict(metrics or {})
+        self.capacity = capacity
+        self.columns = None
+        self.size = 0
+
+    def names(self):
+        return ["step"] + list(STATE_NAMES) + list(self.metrics)
+
+    def __call__(self, sim):
+        counts = stateCounts(sim.grid)
+        stack = counts.shape[:-1]
+        if self.columns is None:
+            self.columns = {"step": np.zeros(self.capacity, dtype=np.int64)}
+            for name in STATE_NAMES:
+                self.columns[name] = np.zeros((self.capacity,) + stack, dtype=np.int64)
+            for name in self.metrics:
+                self.columns[name] = np.zeros((self.capacity,) + stack)
+        elif self.size == self.capacity:
+            self._grow()
+
+        row = self.size
+        self.columns["step"][row] = sim.steps
+        for state, name in enumerate(STATE_NAMES):
+            self.columns[name][row] = counts[..., state]
+        for name, metric in self.metrics.items():
+            self.columns[name][row] = metric(sim, counts)
+        self.size += 1
+
+    def _grow(self):
+        self.capacity *= 2
+        for name, column in self.columns.items():
+            grown = np.zeros((self.capacity,) + column.shape[1:], dtype=column.dtype)
+            grown[:self.size] = column[:self.size]
+            self.columns[name] = grown
+
+    def __getitem__(self, name):
+        if self.columns is None:
+            return np.zeros(0)
+        return self.columns[name][:self.size]
+
+    def asDict(self):
+        """All recorded columns, by name"""
+        return {name: self[name] for name in self.names()}
+
+    def clear(self):
+        self.size = 0
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+'''
+Random number streams for the mushroom model.
+
+Every random draw of a run comes from a NumPy Generator derived from one
+seed. Replicates get independent streams through SeedSequence spawn keys,
+so replicate k of a seed draws the same numbers whether it runs alone, in a
+batched stack or in any worker of a process pool. Steppers that split a
+grid into strips or tiles spawn one stream per piece from the generator
+they are given, so their results do not depend on the number of threads
+either. All draws are made in bulk, a whole grid (or piece) at a time.
+'''
+
+import numpy as np
+
+# Bit generators that can back the streams. PCG64 is NumPy's default;
+# Philox is counter-based.
+BIT_GENERATORS = {
+    "pcg64": np.random.PCG64,
+    "philox": np.random.Philox,
+}
+
+
+# Generator for 'seed', which may be None, an int, a SeedSequence or a
+# Generator (returned as is)
+def makeGenerator(seed=None, bitGenerator="pcg64"):
+    if isinstance(seed, np.random.Generator):
+        return seed
+    if not isinstance(seed, np.random.SeedSequence):
+        seed = np.random.SeedSequence(seed)
+    return np.random.Generator(BIT_GENERATORS[bitGenerator](seed))
+
+
+# Seeds of replicates 0 to count - 1 of 'seed'. Replicate k always gets the
+# same seed, however many replicates are asked for.
+def replicateSeeds(seed, count):
+    if not isinstance(seed, np.random.SeedSequence):
+        seed = np.random.SeedSequence(seed)
+    return [np.random.SeedSequence(seed.entropy, spawn_key=seed.spawn_key + (k,),
+                                   pool_size=seed.pool_size)
+            for k in range(count)]
+
+
+class StackedGenerator:
+
+    """Random streams for a (K, m, n) stack of replicates, one per replicate.
+
+    random() fills the slice of each replicate from that replicate's own
+    generator, so every replicate of a stack draws exactly the numbers it
+    would draw running alone.
+    """
+
+    def __init__(self, generators):
+        self.generators = list(generators)
+
+    def random(self, size, dtype=np.float64):
+        size = tuple(size)
+        if size[0] != len(self.generators):
+            raise ValueError("expected a leading axis of %d replicates"
+                             % len(self.generators))
+        out = np.empty(size, dtype=dtype)
+        for generator, part in zip(self.generators, out):
+            generator.random(size[1:], dtype=dtype, out=part)
+        return out
+
+
+# StackedGenerator for 'replicates' replicates. 'seed' is either one seed,
+# whose first replicates are used, or a list with one seed per replicate.
+def stackGenerator(seed, replicates, bitGenerator="pcg64"):
+    if isinstance(seed, (list, tuple)):
+        seeds = seed
+    else:
+        seeds = replicateSeeds(seed, replicates)
+    return StackedGenerator(makeGenerator(s, bitGenerator) for s in seeds)
+
+
+# Per-replicate generators of 'rng' for a stack of 'count' replicates. A
+# plain Generator is shared by all of them.
+def replicateGenerators(rng, count):
+    if isinstance(rng, StackedGenerator):
+        return rng.generators
+    return [rng] * count
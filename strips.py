@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+'''
+Multi-core stepping of a single large grid.
+
+StripStepper cuts the grid into horizontal strips of stripRows rows and
+steps them on a thread pool; NumPy releases the GIL in the array work, so
+the strips really do run in parallel. Each strip reads its rows plus a one
+row halo above and below straight from the previous grid buffer, which no
+one writes during the step, and writes its rows of the new buffer, so the
+halo exchange costs nothing. Strips at the top and bottom of the grid
+take their outer halo row from the boundary mode: empty for "absorbing",
+the edge row for "reflecting" and the row on the opposite edge for
+"periodic".
+
+Every strip draws from its own stream spawned from the simulation's
+generator, so a run depends on the seed and stripRows only, not on the
+number of workers.
+'''
+
+from concurrent.futures import ThreadPoolExecutor
+import os
+import numpy as np
+from engine import MUSHROOMS, YOUNG, DEFAULT_PARAMS, _MOORE, _SPORE_WINDOW, \
+    _carrySporeProb, mushroomChange, neighborCells, neighborCount, \
+    transitionStates
+
+
+# Spore spawn probability that changeState carries into the first cell of
+# 'row' under mushroomSporeSpawnRule 1: the value of the last cell before
+# it, in row-major order, that is not MUSHROOMS ('carry' if there is none)
+def _carryBefore(grid, row, carry, boundary):
+    for i in range(row - 1, -1, -1):
+        cols = np.flatnonzero(grid[i] != MUSHROOMS)
+        if cols.size:
+            cells = neighborCells(i, cols[-1], grid.shape, _SPORE_WINDOW, boundary)
+            return sum(grid[a, b] == MUSHROOMS for a, b in cells) / np.float32(8)
+    return carry
+
+
+# Row of cells just outside the grid at row index i (-1 or m)
+def _outsideRow(grid, i, boundary):
+    m = grid.shape[0]
+    if boundary == "periodic":
+        return grid[i % m]
+    if boundary == "reflecting":
+        return grid[min(max(i, 0), m - 1)]
+    return np.zeros_like(grid[0])
+
+
+# Steps rows r0:r1 of 'grid' into the same rows of 'out'. Returns the
+# probSpore left after the strip (rule 1) and its change in the number of
+# mushrooms (rule 0).
+def _stepStrip(grid, out, r0, r1, rng, probSpore, rule, boundary, params):
+    # One row of halo on each side. Under "legacy" the grid edges have none,
+    # so the first row still sees no neighbors, as in stepGrid.
+    m = grid.shape[0]
+    h0 = max(r0 - 1, 0)
+    h1 = min(r1 + 1, m)
+    region = grid[h0:h1]
+    if boundary != "legacy" and (r0 == 0 or r1 == m):
+        rows = [region]
+        if r0 == 0:
+            rows.insert(0, _outsideRow(grid, -1, boundary)[None])
+            h0 = -1
+        if r1 == m:
+            rows.append(_outsideRow(grid, m, boundary)[None])
+        region = np.concatenate(rows)
+    inner = slice(r0 - h0, r1 - h0)
+    state = grid[r0:r1]
+
+    last = None
+    if rule == 1:
+        mush = region == MUSHROOMS
+        prob = neighborCount(mush, _SPORE_WINDOW, boundary)[inner] / np.float32(8)
+        carry = probSpore
+        if r0 > 0 and state[0, 0] == MUSHROOMS:
+            carry = _carryBefore(grid, r0, probSpore, boundary)
+        spawnProb, last = _carrySporeProb(prob, mush[inner], carry)
+    else:
+        spawnProb = np.float32(probSpore)
+
+    young = None
+    if params['spreadRule'] == 0:
+        young = neighborCount(region == YOUNG, _MOORE, boundary)[inner]
+    new = transitionStates(state, spawnProb, young, rng, out=out[r0:r1], **params)
+    return last, mushroomChange(state, new) if rule == 0 else 0
+
+
+class StripStepper:
+
+    """Step function that splits a single grid into strips stepped in parallel.
+
+    Takes the stepGrid arguments and gives the same results in distribution.
+    workers is the size of the thread pool (all CPUs when None). Use through
+    Simulation(backend="strips"), and close() it when done to stop the pool.
+    """
+
+    def __init__(self, workers=None, stripRows=128):
+        self.workers = workers or os.cpu_count() or 1
+        self.stripRows = stripRows
+        self.pool = None
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+
+    def __call__(self, grid, rng, probSpore=0, numMushrooms=0, out=None, **params):
+        if grid.ndim != 2:
+            raise ValueError("strip stepping works on a single grid")
+        params = dict(DEFAULT_PARAMS, **params)
+        rule = params.pop('mushroomSporeSpawnRule')
+        boundary = params.pop('boundary')
+        if out is None:
+            out = np.empty(grid.shape, dtype=np.uint8)
+        m = grid.shape[0]
+        starts = range(0, m, self.stripRows)
+        rngs = rng.spawn(len(starts))
+
+        def step(k):
+            r0 = starts[k]
+            return _stepStrip(grid, out, r0, min(r0 + self.stripRows, m),
+                              rngs[k], probSpore, rule, boundary, params)
+
+        if self.workers == 1 or len(starts) == 1:
+            results = [step(k) for k in range(len(starts))]
+        else:
+            if self.pool is None:
+                self.pool = ThreadPoolExecutor(max_workers=self.workers)
+            results = list(self.pool.map(step, range(len(starts))))
+
+        if rule == 1:
+            probSpore = results[-1][0]
+        else:
+            numMushrooms = numMushrooms + sum(change for _, change in results)
+        return out, probSpore, numMushrooms
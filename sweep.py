@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+'''
+Parameter sweeps over ensembles, with an on-disk result cache.
+
+runSweep runs an ensemble (see ensemble.py) at every combination of the
+values given for each swept parameter, e.g.
+
+    result = runSweep({"probSpread": [0.2, 0.4, 0.6], "spreadRule": [0, 1],
+                       "initRule": [1, 2]},
+                      numReplicates=50, numTimeSteps=100, seed=1,
+                      cacheDir="sweep-cache")
+
+Every point is stored in cacheDir under a hash of its parameters, the
+replicate count, the number of steps, the seed and the code version (a
+hash of the modules that decide the results). Running the sweep again, or
+a larger one, only computes the points not in the cache, and a change to
+the model code invalidates the cache by itself. Without a seed the runs are
+not reproducible and nothing is cached.
+
+All points share the seed, so they run on common random numbers, and the
+replicate tasks of all missing points are spread over one process pool.
+'''
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import hashlib
+import itertools
+import json
+import os
+import numpy as np
+from ensemble import _ensembleTasks
+
+# Modules whose code decides the results of a run
+_CODE_MODULES = ("engine.py", "streams.py", "kernels.py", "strips.py", "ensemble.py")
+
+# Arguments of runEnsemble, besides the rule parameters, that a sweep sets
+_RUN_ARGS = {"m": 25, "n": 25, "initRule": 1, "probSpore": 0}
+
+
+# Hash of the source of the modules that decide the results
+def codeVersion():
+    digest = hashlib.sha256()
+    here = os.path.dirname(os.path.abspath(__file__))
+    for name in _CODE_MODULES:
+        with open(os.path.join(here, name), "rb") as f:
+            digest.update(name.encode() + b"\0" + f.read())
+    return digest.hexdigest()[:16]
+
+
+# Plain Python value of 'value', so that NumPy scalars and arrays (as from
+# np.linspace) hash the same as the numbers they hold
+def _plain(value):
+    if isinstance(value, dict):
+        return {key: _plain(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_plain(item) for item in value]
+    if isinstance(value, (np.generic, np.ndarray)):
+        return value.tolist()
+    return value
+
+
+# Cache key of one point of a sweep
+def pointKey(point, numReplicates, numTimeSteps, seed, version):
+    description = {"point": point, "numReplicates": numReplicates,
+                   "numTimeSteps": numTimeSteps, "seed": seed, "code": version}
+    data = json.dumps(_plain(description), sort_keys=True, default=str).encode()
+    return hashlib.sha256(data).hexdigest()
+
+
+# Every combination of the values in 'grid' (name -> list of values), each
+# merged into 'fixed', in row-major order over the names of grid
+def sweepPoints(grid, fixed=None):
+    names = list(grid)
+    return [dict(fixed or {}, **dict(zip(names, values)))
+            for values in itertools.product(*(grid[name] for name in names))]
+
+
+def _load(path):
+    with np.load(path) as data:
+        return data["sims"]
+
+
+def _save(path, sims, point):
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        np.savez(f, sims=sims, point=np.array(json.dumps(_plain(point), default=str)))
+    os.replace(tmp, path)
+
+
+# Runs the sweep over 'grid' and returns a dict with "points" (the list of
+# parameter dicts), "sims" (points x replicates x steps, mushrooms at each
+# step as in runEnsemble), "mean" and "std" over the replicates, and
+# "cached", which points came from the cache. Parameters not in grid are
+# taken from 'fixed'. 'workers' is the number of processes (all CPUs when
+# None, in-process when 1).
+def runSweep(grid, numReplicates, numTimeSteps, seed=None, cacheDir=None,
+             workers=None, batchSize=None, onPoint=None, **fixed):
+    points = sweepPoints(grid, fixed)
+    sims = np.zeros((len(points), numReplicates, numTimeSteps))
+    cached = np.zeros(len(points), dtype=bool)
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    paths = [None] * len(points)
+    if cacheDir is not None and seed is not None:
+        os.makedirs(cacheDir, exist_ok=True)
+        version = codeVersion()
+        for p, point in enumerate(points):
+            key = pointKey(point, numReplicates, numTimeSteps, seed, version)
+            paths[p] = os.path.join(cacheDir, key + ".npz")
+            if os.path.exists(paths[p]):
+                sims[p] = _load(paths[p])
+                cached[p] = True
+
+    # Replicate tasks of every point still to run
+    remaining = {}
+    tasks = []
+    for p, point in enumerate(points):
+        if cached[p]:
+            continue
+        run = dict(_RUN_ARGS)
+        params = {}
+        for name, value in point.items():
+            (run if name in _RUN_ARGS else params)[name] = value
+        args = (numTimeSteps, run["m"], run["n"], run["initRule"], run["probSpore"], params)
+        pointTasks = _ensembleTasks(numReplicates, seed, workers, batchSize)
+        remaining[p] = len(pointTasks)
+        tasks += [(p, task, indices, seeds, args) for task, indices, seeds in pointTasks]
+
+    def collect(p, indices, mushrooms):
+        sims[p, indices] = mushrooms
+        remaining[p] -= 1
+        if remaining[p] == 0:
+            if paths[p] is not None:
+                _save(paths[p], sims[p], points[p])
+            if onPoint is not None:
+                onPoint(points[p], sims[p])
+
+    if workers == 1:
+        for p, task, indices, seeds, args in tasks:
+            collect(p, *task(indices, seeds, *args))
+    elif tasks:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = {pool.submit(task, indices, seeds, *args): p
+                       for p, task, indices, seeds, args in tasks}
+            for future in as_completed(futures):
+                collect(futures[future], *future.result())
+
+    return {"points": points, "sims": sims, "mean": sims.mean(axis=1),
+            "std": sims.std(axis=1), "cached": cached}
@@ -0,0 +1,360 @@
+# -*- coding: utf-8 -*-
+'''
+Tiled grid storage for lawns larger than memory.
+
+A TiledGrid keeps the cell states in fixed-size square tiles of uint8.
+Tiles that are entirely EMPTY are not stored at all, and the tiles can be
+kept in a memory-mapped file instead of in memory. stepTiled advances such
+a grid one tile at a time: each tile is read together with a one-cell halo
+from its neighbors, stepped with the rules of engine.stepGrid and written to
+a second TiledGrid, so peak memory is a few tiles whatever the lawn size.
+EMPTY tiles with no stored neighbor are not read at all: the few cells that
+sprout in them are drawn directly.
+'''
+
+import numpy as np
+from streams import makeGenerator
+from engine import EMPTY, SPORE, YOUNG, MUSHROOMS, INERT, BOUNDARIES, DEFAULT_PARAMS, \
+    _MOORE, _SPORE_WINDOW, Simulation, idleCellProb, mushroomChange, \
+    neighborCells, neighborCount, transitionStates
+
+
+class TiledGrid:
+
+    """An m x n grid of cell states stored as tileSize x tileSize tiles.
+
+    Tiles that are all EMPTY take no storage. With a path, the grid lives
+    in a memory-mapped file of that name and only the pages of stored
+    tiles are ever touched.
+    """
+
+    def __init__(self, shape, tileSize=512, path=None):
+        self.shape = tuple(shape)
+        self.tileSize = tileSize
+        self.path = path
+        self.tileGrid = tuple(-(-size // tileSize) for size in self.shape)
+        self.tiles = {}
+        self.store = None
+        if path is not None:
+            self.store = np.memmap(path, dtype=np.uint8, mode="w+", shape=self.shape)
+
+    @classmethod
+    def fromArray(cls, array, tileSize=512, path=None):
+        """TiledGrid holding a copy of a dense 2D array of states"""
+        grid = cls(np.shape(array), tileSize, path)
+        for key in grid.keys():
+            r0, r1, c0, c1 = grid.bounds(key)
+            grid.setTile(key, array[r0:r1, c0:c1])
+        return grid
+
+    def like(self, path=None):
+        """Empty TiledGrid with the same shape and tile size"""
+        return TiledGrid(self.shape, self.tileSize, path)
+
+    def keys(self):
+        """All tile keys (ti, tj), in row-major order"""
+        return [(ti, tj) for ti in range(self.tileGrid[0])
+                for tj in range(self.tileGrid[1])]
+
+    def stored(self):
+        """Keys of the tiles that are not all EMPTY, in row-major order"""
+        return sorted(self.tiles)
+
+    def bounds(self, key):
+        """(r0, r1, c0, c1) cell range covered by tile key"""
+        ti, tj = key
+        size = self.tileSize
+        return (ti * size, min((ti + 1) * size, self.shape[0]),
+                tj * size, min((tj + 1) * size, self.shape[1]))
+
+    def getTile(self, key):
+        """Copy of the states of tile key"""
+        if key in self.tiles:
+            return np.array(self.tiles[key])
+        r0, r1, c0, c1 = self.bounds(key)
+        return np.zeros((r1 - r0, c1 - c0), dtype=np.uint8)
+
+    def setTile(self, key, states):
+        """Replace the states of tile key"""
+        empty = not np.any(states != EMPTY)
+        if self.store is not None:
+            if empty and key not in self.tiles:
+                return
+            r0, r1, c0, c1 = self.bounds(key)
+            self.store[r0:r1, c0:c1] = states
+            tile = self.store[r0:r1, c0:c1]
+        else:
+            tile = np.array(states, dtype=np.uint8)
+        if empty:
+            self.tiles.pop(key, None)
+        else:
+            self.tiles[key] = tile
+
+    def clear(self):
+        """Set every cell to EMPTY"""
+        for key in list(self.tiles):
+            self.setTile(key, np.zeros_like(self.tiles[key]))
+
+    def region(self, r0, r1, c0, c1):
+        """Copy of the states of rows r0:r1 and columns c0:c1"""
+        out = np.zeros((r1 - r0, c1 - c0), dtype=np.uint8)
+        size = self.tileSize
+        for ti in range(r0 // size, -(-r1 // size)):
+            for tj in range(c0 // size, -(-c1 // size)):
+                tile = self.tiles.get((ti, tj))
+                if tile is None:
+                    continue
+                tr0, tr1, tc0, tc1 = self.bounds((ti, tj))
+                a0, a1 = max(r0, tr0), min(r1, tr1)
+                b0, b1 = max(c0, tc0), min(c1, tc1)
+                out[a0 - r0:a1 - r0, b0 - c0:b1 - c0] = \
+                    tile[a0 - tr0:a1 - tr0, b0 - tc0:b1 - tc0]
+        return out
+
+    def setRegion(self, r0, r1, c0, c1, state):
+        """Set rows r0:r1 and columns c0:c1 to state"""
+        size = self.tileSize
+        for ti in range(r0 // size, -(-r1 // size)):
+            for tj in range(c0 // size, -(-c1 // size)):
+                tr0, tr1, tc0, tc1 = self.bounds((ti, tj))
+                tile = self.getTile((ti, tj))
+                tile[max(r0, tr0) - tr0:min(r1, tr1) - tr0,
+                     max(c0, tc0) - tc0:min(c1, tc1) - tc0] = state
+                self.setTile((ti, tj), tile)
+
+    def cell(self, i, j):
+        tile = self.tiles.get((i // self.tileSize, j // self.tileSize))
+        if tile is None:
+            return EMPTY
+        return tile[i % self.tileSize, j % self.tileSize]
+
+    def toArray(self):
+        """Dense copy of the whole grid"""
+        return self.region(0, self.shape[0], 0, self.shape[1])
+
+    def count(self, state):
+        """Number of cells in state"""
+        if state == EMPTY:
+            total = self.shape[0] * self.shape[1]
+            return total - sum(np.count_nonzero(t) for t in self.tiles.values())
+        return sum(np.count_nonzero(t == state) for t in self.tiles.values())
+
+
+# Same starting grids as engine.initGrid, built tile by tile
+def initTiled(t, shape, rng, probSpore=0, tileSize=512, path=None):
+    grid = TiledGrid(shape, tileSize, path)
+    m, n = shape
+    if t == 0:
+        for key in grid.keys():
+            r0, r1, c0, c1 = grid.bounds(key)
+            spores = rng.random((r1 - r0, c1 - c0)) < probSpore
+            grid.setTile(key, np.where(spores, SPORE, EMPTY))
+    elif t in (1, 3, 4):
+        grid.setRegion(m // 2, m // 2 + 1, n // 2, n // 2 + 1, SPORE)
+    elif t == 2:
+        grid.setRegion(m // 4, m // 4 + 1, n // 2, n // 2 + 1, SPORE)
+        grid.setRegion(3 * (m // 4), 3 * (m // 4) + 1, n // 2, n // 2 + 1, SPORE)
+    else:
+        raise ValueError("unknown initRule %r" % (t,))
+    if t == 3:
+        grid.setRegion(0, m, 0, 1, INERT)
+        grid.setRegion(0, m, n - 1, n, INERT)
+        grid.setRegion(0, 1, 0, n, INERT)
+        grid.setRegion(m - 1, m, 0, n, INERT)
+    elif t == 4:
+        grid.setRegion(int(3 * m / 5), m, int(n / 5), int(4 * n / 5), INERT)
+    return grid
+
+
+# Spore spawn probability that changeState carries into cell (i, j) under
+# mushroomSporeSpawnRule 1: the value of the last cell before it, in
+# row-major order, that is not MUSHROOMS ('carry' if there is none).
+def _carryInto(grid, i, j, carry, boundary):
+    n = grid.shape[1]
+    while True:
+        j -= 1
+        if j < 0:
+            i -= 1
+            j = n - 1
+            if i < 0:
+                return carry
+        if grid.cell(i, j) != MUSHROOMS:
+            cells = neighborCells(i, j, grid.shape, _SPORE_WINDOW, boundary)
+            return sum(grid.cell(a, b) == MUSHROOMS for a, b in cells) / 8
+
+
+# Indices lo:hi along an axis of length 'size' mapped onto the grid under
+# 'boundary', with -1 for positions that stand for nothing
+def _axisIndices(lo, hi, size, boundary):
+    indices = np.arange(lo, hi)
+    if boundary == "periodic":
+        return indices % size
+    if boundary == "reflecting":
+        return np.clip(indices, 0, size - 1)
+    return np.where((indices >= 0) & (indices < size), indices, -1)
+
+
+# Splits 'indices' into runs of consecutive values, given as (first,
+# last + 1, position of the run in indices). Entries of -1 are skipped.
+def _runs(indices):
+    runs = []
+    k = 0
+    while k < len(indices):
+        if indices[k] < 0:
+            k += 1
+            continue
+        end = k + 1
+        while end < len(indices) and indices[end] == indices[end - 1] + 1:
+            end += 1
+        runs.append((indices[k], indices[end - 1] + 1, k))
+        k = end
+    return runs
+
+
+# Cells r0 - 1:r1 + 1, c0 - 1:c1 + 1 of 'grid', with the ones outside the
+# grid filled in according to 'boundary'
+def _haloRegion(grid, r0, r1, c0, c1, boundary):
+    rows = _axisIndices(r0 - 1, r1 + 1, grid.shape[0], boundary)
+    cols = _axisIndices(c0 - 1, c1 + 1, grid.shape[1], boundary)
+    region = np.zeros((rows.size, cols.size), dtype=np.uint8)
+    for a0, a1, i in _runs(rows):
+        for b0, b1, j in _runs(cols):
+            region[i:i + a1 - a0, j:j + b1 - b0] = grid.region(a0, a1, b0, b1)
+    return region
+
+
+# Fills each MUSHROOMS cell along the rows of 'prob' with the value of the
+# last non-MUSHROOMS cell before it in the row, or with 'start' for that row
+def _fillRows(prob, mush, start):
+    last = np.where(mush, -1, np.arange(prob.shape[1]))
+    last = np.maximum.accumulate(last, axis=1)
+    prob = np.concatenate([start[:, None], prob], axis=1)
+    return np.take_along_axis(prob, last + 1, axis=1)
+
+
+# Tile keys to step in full: the stored tiles and their neighbors
+def _activeTiles(grid, boundary):
+    active = set()
+    rows, cols = grid.tileGrid
+    for ti, tj in grid.tiles:
+        for di in (-1, 0, 1):
+            for dj in (-1, 0, 1):
+                if boundary == "periodic":
+                    active.add(((ti + di) % rows, (tj + dj) % cols))
+                elif 0 <= ti + di < rows and 0 <= tj + dj < cols:
+                    active.add((ti + di, tj + dj))
+    return sorted(active)
+
+
+# Advances the TiledGrid 'grid' by one time step, writing the new states
+# into 'out' (cleared first; a new in-memory TiledGrid when None). Same
+# arguments and results as engine.stepGrid.
+def stepTiled(grid, rng, probSpore=0, numMushrooms=0, out=None, **params):
+    params = dict(DEFAULT_PARAMS, **params)
+    rule = params.pop('mushroomSporeSpawnRule')
+    boundary = params.pop('boundary')
+    if out is None:
+        out = grid.like()
+    else:
+        out.clear()
+    m, n = grid.shape
+    carry = probSpore
+
+    # One stream per stepped tile, and one for the idle tiles
+    active = _activeTiles(grid, boundary)
+    rngs = rng.spawn(len(active) + 1)
+    for key, tileRng in zip(active, rngs):
+        r0, r1, c0, c1 = grid.bounds(key)
+        if boundary == "legacy":
+            # One-cell halo wherever there is a neighbor. At the top and left
+            # edges of the grid there is none, so the first row and column of
+            # the region are those of the grid, as stepGrid expects.
+            R0, C0 = max(r0 - 1, 0), max(c0 - 1, 0)
+            region = grid.region(R0, min(r1 + 1, m), C0, min(c1 + 1, n))
+        else:
+            R0, C0 = r0 - 1, c0 - 1
+            region = _haloRegion(grid, r0, r1, c0, c1, boundary)
+        inner = (slice(r0 - R0, r1 - R0), slice(c0 - C0, c1 - C0))
+
+        if rule == 1:
+            mush = region == MUSHROOMS
+            spawnProb = neighborCount(mush, _SPORE_WINDOW, boundary) / np.float32(8)
+            innerMush = mush[inner]
+            start = np.zeros(r1 - r0, dtype=np.float32)
+            for k in np.flatnonzero(innerMush[:, 0]):
+                start[k] = _carryInto(grid, r0 + k, c0, carry, boundary)
+            spawnProb[inner] = _fillRows(spawnProb[inner], innerMush, start)
+        else:
+            spawnProb = np.float32(probSpore)
+
+        young = None
+        if params['spreadRule'] == 0:
+            young = neighborCount(region == YOUNG, _MOORE, boundary)
+        new = transitionStates(region, spawnProb, young, tileRng, **params)[inner]
+        if rule == 0:
+            numMushrooms = numMushrooms + mushroomChange(region[inner], new)
+        out.setTile(key, new)
+
+    # Tiles far from anything are all EMPTY with nothing around them
+    idleSpawn = probSpore if rule == 0 else 0.0
+    idleProb = idleCellProb(idleSpawn, params)
+    if idleProb > 0:
+        rng = rngs[-1]
+        active = set(active)
+        for key in grid.keys():
+            if key in active:
+                continue
+            r0, r1, c0, c1 = grid.bounds(key)
+            size = (r1 - r0) * (c1 - c0)
+            count = rng.binomial(size, idleProb)
+            if count == 0:
+                continue
+            tile = np.zeros(size, dtype=np.uint8)
+            cells = rng.choice(size, count, replace=False)
+            tile[cells] = np.where(rng.random(count) * idleProb < idleSpawn,
+                                   SPORE, YOUNG)
+            out.setTile(key, tile.reshape(r1 - r0, c1 - c0))
+
+    if rule == 1:
+        probSpore = _carryInto(grid, m - 1, n, carry, boundary)
+    return out, probSpore, numMushrooms
+
+
+class TiledSimulation(Simulation):
+
+    """A Simulation whose grid is a TiledGrid.
+
+    Steps stream over the tiles (see stepTiled), ping-ponging between two
+    TiledGrids. With a path, the two grids are memory-mapped to path + ".a"
+    and path + ".b". Viewers are not supported; use grid.region to look at
+    part of the lawn.
+    """
+
+    def __init__(self, m=25, n=25, initRule=1, seed=None, probSpore=0,
+                 tileSize=512, path=None, **params):
+        unknown = set(params) - set(DEFAULT_PARAMS)
+        if unknown:
+            raise TypeError("unknown rule parameters: %s" % ", ".join(sorted(unknown)))
+        self.params = dict(DEFAULT_PARAMS, **params)
+        if self.params['boundary'] not in BOUNDARIES:
+            raise ValueError("unknown boundary %r" % (self.params['boundary'],))
+        self.shape = (m, n)
+        self.initRule = initRule
+        self.rng = makeGenerator(seed)
+        paths = (None, None) if path is None else (path + ".a", path + ".b")
+        self.grid = initTiled(initRule, self.shape, self.rng, probSpore,
+                              tileSize, paths[0])
+        self.spare = self.grid.like(paths[1])
+        self.stepper = stepTiled
+        self.probSpore = 0
+        self.numMushrooms = 0
+        self.steps = 0
+        self.viewers = []
+
+    def run(self, numSteps):
+        """Run numSteps steps and return the number of mushrooms after each"""
+        mushrooms = np.zeros(numSteps)
+        for k in range(numSteps):
+            self.step()
+            mushrooms[k] = self.numMushrooms
+        return mushrooms
@@ -0,0 +1,233 @@
+# -*- coding: utf-8 -*-
+'''
+Recording of full grid trajectories.
+
+TrajectoryRecorder streams every frame of a run to disk. Frames are stored
+as the XOR of the grid with the previous frame, which is zero wherever
+nothing changed, in chunks of keyframeEvery frames that each start with a
+full keyframe. Each chunk is packed two cells per byte and compressed with
+zlib as a whole. Encoding and writing happen on a background thread, so
+recording costs the stepping thread one grid copy per frame.
+
+    recorder = TrajectoryRecorder("run.traj")
+    sim.attach(recorder)
+    sim.run(500)
+    recorder.close()
+
+TrajectoryReader memory-maps a recorded file and gives random access to
+any frame; only the chunk holding it is decompressed.
+
+    with TrajectoryReader("run.traj") as frames:
+        grid = frames[250]
+        stack = frames[100:200]
+
+File layout: a magic line, a JSON header, the chunks (each prefixed with
+its byte length and number of frames) and a JSON index of the chunks
+followed by its offset and length. A file whose run died before close()
+has no index; the reader then finds the chunks by walking their prefixes.
+'''
+
+import json
+import mmap
+import queue
+import struct
+import threading
+import zlib
+import numpy as np
+from engine import packStates, unpackStates
+
+MAGIC = b"FHTRAJ1\n"
+_LENGTH = struct.Struct("<I")
+_CHUNK = struct.Struct("<QI")
+_FOOTER = struct.Struct("<QQ")
+
+
+class TrajectoryRecorder:
+
+    """Viewer that appends every grid it sees to a trajectory file.
+
+    Takes the shape and step number from the first frame; attached to a
+    Simulation, frame k is the grid after step k. 'level' is the zlib
+    compression level. At most 'backlog' frames wait for the writer
+    before recording blocks. Call close() to write the rest and the index;
+    write errors are raised from the next frame or from close().
+    """
+
+    def __init__(self, path, keyframeEvery=64, level=1, backlog=64):
+        self.path = path
+        self.keyframeEvery = keyframeEvery
+        self.level = level
+        self.file = open(path, "wb")
+        self.shape = None
+        self.numFrames = 0
+        self.error = None
+        self.queue = queue.Queue(maxsize=backlog)
+        self.thread = threading.Thread(target=self._writer, daemon=True)
+        self.thread.start()
+
+    def __call__(self, sim):
+        self.record(sim.grid, sim.steps)
+
+    def record(self, grid, step=None):
+        """Append a copy of grid as the next frame"""
+        self._raise()
+        grid = np.array(grid, dtype=np.uint8)
+        if self.shape is None:
+            self.shape = grid.shape
+            header = {"shape": list(grid.shape), "firstStep": step or 0,
+                      "keyframeEvery": self.keyframeEvery}
+            self.queue.put(("header", header))
+        elif grid.shape != self.shape:
+            raise ValueError("frame of shape %r in a trajectory of shape %r"
+                             % (grid.shape, self.shape))
+        self.queue.put(("frame", grid))
+        self.numFrames += 1
+
+    def close(self):
+        """Write the pending frames and the index, and close the file"""
+        if self.thread.is_alive():
+            self.queue.put(("close", None))
+            self.thread.join()
+        self._raise()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _raise(self):
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    def _writer(self):
+        chunks = []
+        frames = []
+        previous = None
+        header = None
+        try:
+            while True:
+                kind, item = self.queue.get()
+                if kind == "header":
+                    header = item
+                    data = json.dumps(header).encode()
+                    self.file.write(MAGIC + _LENGTH.pack(len(data)) + data)
+                elif kind == "frame":
+                    # XOR against the previous frame, except for keyframes
+                    frames.append(item if not frames else item ^ previous)
+                    previous = item
+                    if len(frames) == self.keyframeEvery:
+                        chunks.append(self._writeChunk(frames))
+                        frames = []
+                else:
+                    break
+            if header is not None:
+                if frames:
+                    chunks.append(self._writeChunk(frames))
+                index = json.dumps({"chunks": chunks}).encode()
+                offset = self.file.tell()
+                self.file.write(index + _FOOTER.pack(offset, len(index)) + MAGIC)
+        except Exception as e:
+            self.error = e
+        finally:
+            self.file.close()
+
+    # Compresses one chunk of frames, writes it and returns its index entry
+    # [offset of the data, length, number of frames]
+    def _writeChunk(self, frames):
+        data = zlib.compress(packStates(np.stack(frames)).tobytes(), self.level)
+        self.file.write(_CHUNK.pack(len(data), len(frames)))
+        offset = self.file.tell()
+        self.file.write(data)
+        return [offset, len(data), len(frames)]
+
+
+class TrajectoryReader:
+
+    """Random access to the frames of a trajectory file.
+
+    len() is the number of frames; indexing with an int gives one grid and
+    with a slice a stack of them. frames() iterates in order. The last
+    decoded chunk is kept, so reading frames in order decompresses every
+    chunk once.
+    """
+
+    def __init__(self, path):
+        self.file = open(path, "rb")
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.map[:len(MAGIC)] != MAGIC:
+            raise ValueError("%s is not a trajectory file" % (path,))
+        start = len(MAGIC) + _LENGTH.size
+        length, = _LENGTH.unpack_from(self.map, len(MAGIC))
+        header = json.loads(self.map[start:start + length])
+        self.shape = tuple(header["shape"])
+        self.firstStep = header["firstStep"]
+        self.keyframeEvery = header["keyframeEvery"]
+        self.chunks = self._readIndex(start + length)
+        self.starts = np.cumsum([0] + [count for _, _, count in self.chunks])
+        self.cached = (None, None)
+
+    # Chunk index from the footer, or found by walking the chunks of a file
+    # that was never closed
+    def _readIndex(self, first):
+        size = len(self.map)
+        end = size - len(MAGIC)
+        if size >= first + _FOOTER.size + len(MAGIC) and self.map[end:] == MAGIC:
+            offset, length = _FOOTER.unpack_from(self.map, end - _FOOTER.size)
+            return json.loads(self.map[offset:offset + length])["chunks"]
+        chunks = []
+        position = first
+        while position + _CHUNK.size <= size:
+            length, count = _CHUNK.unpack_from(self.map, position)
+            position += _CHUNK.size
+            if position + length > size:
+                break
+            chunks.append([position, length, count])
+            position += length
+        return chunks
+
+    def __len__(self):
+        return int(self.starts[-1])
+
+    def _chunk(self, c):
+        if self.cached[0] != c:
+            offset, length, count = self.chunks[c]
+            data = zlib.decompress(memoryview(self.map)[offset:offset + length])
+            deltas = unpackStates(np.frombuffer(data, dtype=np.uint8), (count,) + self.shape)
+            self.cached = (c, np.bitwise_xor.accumulate(deltas, axis=0))
+        return self.cached[1]
+
+    def frame(self, t):
+        """Grid of frame t"""
+        if t < 0:
+            t += len(self)
+        if not 0 <= t < len(self):
+            raise IndexError("frame %d out of range" % t)
+        c = int(np.searchsorted(self.starts, t, side="right")) - 1
+        return self._chunk(c)[t - self.starts[c]].copy()
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            indices = range(*key.indices(len(self)))
+            out = np.empty((len(indices),) + self.shape, dtype=np.uint8)
+            for k, t in enumerate(indices):
+                out[k] = self.frame(t)
+            return out
+        return self.frame(key)
+
+    def frames(self, start=0, stop=None):
+        """Iterate over the frames start to stop - 1"""
+        for t in range(start, len(self) if stop is None else stop):
+            yield self.frame(t)
+
+    def close(self):
+        self.cached = (None, None)
+        self.map.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()